@@ -0,0 +1,352 @@
+import asyncio
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from aiormq.exceptions import DeliveryError
+from pamqp.commands import Basic
+
+from tsp_solver.dispatcher import Dispatcher, load_profile_captures
+
+
+class FakeExchange:
+
+    def __init__(self):
+        self.published = []
+        self.nack = False
+
+    async def publish(self, message, routing_key):
+        # A broker nack is raised by aiormq, as with publisher confirms
+        if self.nack:
+            raise DeliveryError(None, Basic.Nack())
+        self.published.append(json.loads(message.body.decode()))
+        return Basic.Ack()
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.default_exchange = FakeExchange()
+
+
+class FakeMessage:
+
+    def __init__(self, data, expiration=None, timestamp=None):
+        self.body = json.dumps(data).encode()
+        self.expiration = expiration
+        self.timestamp = timestamp
+        self.processed = False
+        self.result = None
+
+    def process(self, ignore_processed=False):
+        return FakeProcessContext(self)
+
+    async def ack(self):
+        self.processed, self.result = True, 'ack'
+
+    async def nack(self, requeue=True):
+        self.processed, self.result = True, 'requeue' if requeue else 'reject'
+
+
+class FakeProcessContext:
+
+    def __init__(self, message):
+        self.message = message
+
+    async def __aenter__(self):
+        return self.message
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if not self.message.processed:
+            await (self.message.nack(requeue=False) if exc_type else self.message.ack())
+
+
+class FakeQueue:
+
+    name = 'TSP_INPUT_QUEUE'
+
+    def __init__(self, messages):
+        self.messages = asyncio.Queue()
+        for message in messages:
+            self.messages.put_nowait(message)
+
+    def iterator(self, timeout):
+        self.timeout = timeout
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await asyncio.wait_for(self.messages.get(), self.timeout)
+
+
+def vrp_request(request_id, size=10):
+    return {
+        'id': request_id,
+        'message_type': 'VRP',
+        'depot': 0,
+        'num_vehicles': 2,
+        'locations': [{'latitude': i * 0.37 % 1, 'longitude': i * 0.61 % 1} for i in range(size)],
+        'max_distance': 100000,
+        'cost_coefficient': 100
+    }
+
+
+def vrptw_request(request_id, size=10):
+    data = vrp_request(request_id, size)
+    del data['max_distance'], data['cost_coefficient']
+    data.update({
+        'message_type': 'VRPTW',
+        'time_windows': [[0, 1000]] * size,
+        'wait_time': 1000,
+        'max_time_vehicle': 1000
+    })
+    return data
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        load_profile_captures.cache_clear()
+        self.channel = FakeChannel()
+        self.dispatcher = Dispatcher(channel=self.channel, queue=None)
+        self.published = self.channel.default_exchange.published
+
+    async def process(self, message):
+        await self.dispatcher.process_message(message)
+        await self.dispatcher.publisher.flush()
+
+    async def test_solve(self):
+        await self.process(FakeMessage(vrp_request('1')))
+
+        self.assertEqual(self.published[0]['code'], 200)
+        self.assertEqual(len(self.published[0]['solution']['routes']), 2)
+
+    async def test_solve_vrptw(self):
+        await self.process(FakeMessage(vrptw_request('1')))
+
+        self.assertEqual(self.published[0]['code'], 200)
+        self.assertEqual(len(self.published[0]['solution']['routes']), 2)
+
+    async def test_solve_vrptw_rolling_horizon(self):
+        data = vrptw_request('1')
+        data['time_windows'] = [[0, 1000]] + [[100 * i, 100 * i + 200] for i in range(1, 10)]
+        data['horizon_length'] = 300
+        data['horizon_overlap'] = 100
+
+        await self.process(FakeMessage(data))
+
+        self.assertEqual(self.published[0]['code'], 200)
+        visited = [location for route in self.published[0]['solution']['routes'] for location in route['route'][1:-1]]
+        self.assertEqual(sorted(visited), list(range(1, 10)))
+
+    async def test_requested_time_limit(self):
+        self.dispatcher.min_search_time = 0.1
+        data = vrp_request('1')
+        data['time_limit'] = 0.2
+
+        await self.process(FakeMessage(data))
+
+        self.assertEqual(self.published[0]['code'], 200)
+        self.assertEqual(self.published[0]['solution']['search_budget']['time_limit'], 0.2)
+
+    async def test_clamped_time_limit(self):
+        self.dispatcher.min_search_time = 0.1
+        self.dispatcher.max_search_time = 0.3
+        data = vrp_request('1')
+        data['time_limit'] = 3600
+
+        await self.process(FakeMessage(data))
+
+        budget = self.published[0]['solution']['search_budget']
+        self.assertEqual(budget['time_limit'], 0.3)
+        self.assertIn('clamped', budget['reason'])
+
+    async def test_invalid_time_limit(self):
+        data = vrp_request('1')
+        data['time_limit'] = -1
+
+        await self.process(FakeMessage(data))
+
+        self.assertEqual(self.published[0]['code'], 400)
+
+    async def test_optimality_gap(self):
+        data = vrp_request('1')
+        data['num_vehicles'] = 1
+        data['time_limit'] = 5
+        data['optimality_gap'] = 0.5
+
+        await self.process(FakeMessage(data))
+
+        solution = self.published[0]['solution']
+        self.assertLessEqual(solution['gap'], 0.5)
+        self.assertGreater(solution['lower_bound'], 0)
+
+    async def test_expired_message(self):
+        timestamp = datetime.utcnow() - timedelta(seconds=60)
+
+        await self.process(FakeMessage(vrp_request('1'), expiration=30, timestamp=timestamp))
+
+        self.assertEqual(self.published[0]['code'], 408)
+
+    async def test_cancel_pending_request(self):
+        await self.process(FakeMessage({'message_type': 'CANCEL', 'request_id': '1'}))
+        await self.process(FakeMessage(vrp_request('1')))
+
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.published[0]['code'], 499)
+
+    async def test_cancellation_not_applied_to_later_request(self):
+        await self.process(FakeMessage({'message_type': 'CANCEL', 'request_id': '1'}))
+        resent = datetime.utcnow() + timedelta(seconds=5)
+        await self.process(FakeMessage(vrp_request('1'), timestamp=resent))
+
+        self.assertEqual(self.published[0]['code'], 200)
+
+    async def test_cancellation_expiry(self):
+        self.dispatcher.cancellation_ttl = 0.01
+        await self.process(FakeMessage({'message_type': 'CANCEL', 'request_id': '1'}))
+        await asyncio.sleep(0.02)
+        await self.process(FakeMessage({'message_type': 'CANCEL', 'request_id': '2'}))
+
+        # The expired cancellation is forgotten once another one is received
+        self.assertEqual(list(self.dispatcher.cancelled), ['2'])
+
+        await asyncio.sleep(0.02)
+        await self.process(FakeMessage(vrp_request('2')))
+        self.assertEqual(self.published[0]['code'], 200)
+
+    async def test_cancel_in_flight_request(self):
+        task = asyncio.create_task(self.process(FakeMessage(vrp_request('1', size=300))))
+        while '1' not in self.dispatcher.in_flight:
+            await asyncio.sleep(0.01)
+
+        self.dispatcher.cancel_request('1')
+        await task
+
+        self.assertEqual(self.published[0]['code'], 499)
+
+    async def test_profile_matching_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.dispatcher.profile_directory = directory
+            self.dispatcher.process_profile_message({'message_type': 'PROFILE', 'count': 1, 'match': {'id': '2'}})
+
+            await self.process(FakeMessage(vrp_request('1')))
+            await self.process(FakeMessage(vrp_request('2')))
+            await self.process(FakeMessage(vrp_request('2')))
+
+            files = sorted(os.listdir(directory))
+            self.assertEqual(len(files), 3)
+            self.assertTrue(files[0].startswith('2-') and files[0].endswith('.prof'))
+
+            # The ortools search log is written next to the profile
+            self.assertTrue(files[2].endswith('.search.log'))
+            with open(os.path.join(directory, files[2])) as file:
+                self.assertIn('Start search', file.read())
+
+            functions = [function for _, _, function in pstats.Stats(os.path.join(directory, files[0])).stats]
+            self.assertIn('SolveWithParameters', functions)
+            self.assertIn('get_routes', functions)
+
+    async def test_profile_capture_shared_by_consumers(self):
+        other = Dispatcher(channel=self.channel, queue=None)
+        profile_message = {'message_type': 'PROFILE', 'id': 'capture', 'count': 1, 'match': {'message_type': 'VRP'}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            # The PROFILE message reaches both consumers through the control exchange
+            for dispatcher in (self.dispatcher, other):
+                dispatcher.profile_directory = directory
+                dispatcher.process_profile_message(profile_message)
+
+            await self.process(FakeMessage(vrp_request('1')))
+            await other.process_message(FakeMessage(vrp_request('2')))
+            await other.publisher.flush()
+
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 3)
+            self.assertTrue(all(file.startswith('1-') for file in files))
+
+    async def test_profile_stays_in_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.dispatcher.profile_directory = os.path.join(directory, 'profiles')
+            data = vrp_request('../../escaped')
+            data['profile'] = True
+
+            await self.process(FakeMessage(data))
+
+            self.assertEqual(os.listdir(directory), ['profiles'])
+            files = os.listdir(self.dispatcher.profile_directory)
+            self.assertEqual(len(files), 3)
+            self.assertTrue(all(file.startswith('.._.._escaped-') for file in files))
+
+    async def test_response_confirmed(self):
+        message = FakeMessage(vrp_request('1'))
+
+        await self.process(message)
+
+        self.assertEqual(message.result, 'ack')
+
+    async def test_response_not_confirmed(self):
+        self.channel.default_exchange.nack = True
+        message = FakeMessage(vrp_request('1'))
+
+        await self.process(message)
+
+        self.assertEqual(message.result, 'requeue')
+
+    async def test_close_unconfirmed_responses(self):
+        async def publish(message, routing_key):
+            # The broker never confirms the response
+            await asyncio.Event().wait()
+
+        self.channel.default_exchange.publish = publish
+        self.dispatcher.publish_timeout = 0.05
+        message = FakeMessage(vrp_request('1'))
+        await self.dispatcher.process_message(message)
+        publishing_task = self.dispatcher.publisher.publishing_task
+
+        with self.assertLogs(level='WARNING'):
+            await self.dispatcher.close()
+
+        # The message is left unacked, and requeued by the broker once the channel is closed
+        self.assertTrue(publishing_task.cancelled())
+        self.assertIsNone(self.dispatcher.publisher.publishing_task)
+        self.assertFalse(message.processed)
+
+    async def test_drain_idle_consumer(self):
+        self.dispatcher.queue = FakeQueue([])
+        self.dispatcher.iterator_timeout = 0.05
+        task = asyncio.create_task(self.dispatcher.consume())
+        await asyncio.sleep(0.01)
+
+        await self.dispatcher.drain(timeout=1)
+
+        self.assertTrue(task.done())
+
+    async def test_drain_requeues_in_flight_message(self):
+        message = FakeMessage(vrp_request('1', size=300))
+        self.dispatcher.queue = FakeQueue([message])
+        self.dispatcher.iterator_timeout = 0.05
+        task = asyncio.create_task(self.dispatcher.consume())
+        while '1' not in self.dispatcher.in_flight:
+            await asyncio.sleep(0.01)
+
+        await self.dispatcher.drain(timeout=0.01)
+
+        self.assertTrue(task.done())
+        self.assertEqual(message.result, 'requeue')
+        self.assertEqual(self.published, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
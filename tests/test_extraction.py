@@ -0,0 +1,58 @@
+import unittest
+
+from tsp_solver.vrp_solver import ortools_vrp_solver
+from tsp_solver.vrptw_solver import ortools_vrptw_solver
+
+time_matrix = [[0, 6, 9, 8, 7],
+               [6, 0, 8, 3, 2],
+               [9, 8, 0, 11, 10],
+               [8, 3, 11, 0, 6],
+               [7, 2, 10, 6, 0]]
+
+time_windows = [[0, 5], [7, 12], [10, 15], [16, 18], [10, 13]]
+
+
+class TestSolutionExtraction(unittest.TestCase):
+
+    def test_vrp_without_empty_routes(self):
+        result = ortools_vrp_solver(time_matrix, 0, 3, 100, 0)
+        slim = ortools_vrp_solver(time_matrix, 0, 3, 100, 0, include_empty_routes=False)
+
+        used = [route for route in result['routes'] if len(route['route']) > 2]
+        self.assertLess(len(used), 3)
+        self.assertEqual(slim['routes'], used)
+        self.assertEqual(slim['max_route_distance'], result['max_route_distance'])
+
+    def test_vrp_route_distances(self):
+        result = ortools_vrp_solver(time_matrix, 0, 2, 100, 1)
+
+        for route in result['routes']:
+            nodes = route['route']
+            self.assertEqual(route['distance'], sum(time_matrix[i][j] for i, j in zip(nodes, nodes[1:])))
+
+    def test_vrptw_without_slacks(self):
+        result = ortools_vrptw_solver(time_matrix, time_windows, 0, 3, 30, 30)
+        slim = ortools_vrptw_solver(time_matrix, time_windows, 0, 3, 30, 30, include_slacks=False,
+                                    include_empty_routes=False)
+
+        used = [route for route in result['routes'] if len(route['route']) > 2]
+        self.assertEqual(len(slim['routes']), len(used))
+        self.assertEqual(slim['total_time'], result['total_time'])
+        for route, slim_route in zip(used, slim['routes']):
+            self.assertNotIn('time_windows', slim_route)
+            self.assertEqual(slim_route['route'], route['route'])
+            self.assertEqual(slim_route['arrival_times'], [earliest for earliest, _ in route['time_windows']])
+
+    def test_vrptw_time_windows(self):
+        result = ortools_vrptw_solver(time_matrix, time_windows, 0, 2, 30, 30)
+
+        for route in result['routes']:
+            self.assertEqual(len(route['time_windows']), len(route['route']))
+            self.assertEqual(route['route_time'], route['time_windows'][-1][0])
+            for node, (earliest, latest) in zip(route['route'][1:-1], route['time_windows'][1:-1]):
+                self.assertLessEqual(time_windows[node][0], earliest)
+                self.assertLessEqual(latest, time_windows[node][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
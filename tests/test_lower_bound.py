@@ -0,0 +1,71 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from tsp_solver.utils.lower_bound import spanning_tree, one_tree_bound, vrp_lower_bound, relative_gap
+from tsp_solver.vrp_solver import ortools_vrp_solver
+
+
+def random_matrix(size, seed=0):
+    points = np.random.default_rng(seed).random((size, 2)) * 1000
+    return np.rint(np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))).astype(int).tolist()
+
+
+def optimal_tour(distance_matrix):
+    nodes = range(1, len(distance_matrix))
+    return min(sum(distance_matrix[i][j] for i, j in zip((0,) + tour, tour + (0,)))
+               for tour in itertools.permutations(nodes))
+
+
+class TestLowerBound(unittest.TestCase):
+
+    def test_spanning_tree(self):
+        weights = np.array([[0, 0, 5],
+                            [0, 0, 5],
+                            [5, 5, 0]], dtype=float)
+
+        weight, degrees = spanning_tree(weights)
+
+        self.assertEqual(weight, 5)
+        self.assertEqual(degrees.sum(), 4)
+
+    def test_one_tree_bound_is_valid(self):
+        for seed in range(3):
+            distance_matrix = random_matrix(8, seed)
+
+            bound = one_tree_bound(np.array(distance_matrix, dtype=float))
+
+            self.assertLessEqual(bound, optimal_tour(distance_matrix) + 1e-6)
+            self.assertGreaterEqual(bound, 0.9 * optimal_tour(distance_matrix))
+
+    def test_vrp_lower_bound_is_valid(self):
+        distance_matrix = random_matrix(20)
+
+        for num_vehicles, cost_coefficient in ((1, 0), (1, 10), (3, 0), (3, 10)):
+            result = ortools_vrp_solver(distance_matrix, 0, num_vehicles, 100000, cost_coefficient, time_limit=0.5)
+            objective = sum(route['distance'] for route in result['routes']) \
+                + cost_coefficient * result['max_route_distance']
+
+            self.assertLessEqual(vrp_lower_bound(distance_matrix, 0, num_vehicles, cost_coefficient), objective)
+
+    def test_relative_gap(self):
+        self.assertEqual(relative_gap(100, 90), 0.1)
+        self.assertEqual(relative_gap(100, 120), 0)
+        self.assertEqual(relative_gap(0, 0), 0)
+
+    def test_stop_within_gap(self):
+        distance_matrix = random_matrix(60)
+        lower_bound = vrp_lower_bound(distance_matrix, 0, 1, 0)
+        search_log = []
+
+        result = ortools_vrp_solver(distance_matrix, 0, 1, 100000, 0, time_limit=10, search_log=search_log,
+                                    lower_bound=lower_bound, optimality_gap=0.2)
+
+        self.assertEqual(result['lower_bound'], lower_bound)
+        self.assertLessEqual(result['gap'], 0.2)
+        self.assertLess(search_log[-1][0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+from tsp_solver.utils.helpers import euclidean_distance, euclidean_time, euclidean_distance_matrix, \
+    euclidean_time_matrix, generate_distance_matrix
+from tsp_solver.utils.models import VrpRequest
+from tsp_solver.utils.matrix_cache import MatrixCache
+
+
+class TestMatrixCache(unittest.TestCase):
+
+    def setUp(self):
+        self.locations = [{'latitude': 40.7128, 'longitude': -74.0060},
+                          {'latitude': 34.0522, 'longitude': -118.2437},
+                          {'latitude': 41.8781, 'longitude': -87.6298},
+                          {'latitude': 40.7128, 'longitude': -74.0060}]
+
+    def test_vectorized_matrices(self):
+        distances = [[euclidean_distance(p, q) for q in self.locations] for p in self.locations]
+        times = [[euclidean_time(p, q) for q in self.locations] for p in self.locations]
+
+        self.assertEqual(euclidean_distance_matrix(self.locations, self.locations).tolist(), distances)
+        self.assertEqual(euclidean_time_matrix(self.locations, self.locations).tolist(), times)
+
+    def test_hits(self):
+        cache = MatrixCache()
+
+        first, first_stats = cache.matrix('distance', self.locations[:2], euclidean_distance_matrix)
+        second, second_stats = cache.matrix('distance', self.locations, euclidean_distance_matrix)
+
+        self.assertEqual(first_stats['hit_rate'], 0.0)
+        self.assertEqual(second_stats['hit_rate'], 9 / 16)
+        self.assertEqual(second, euclidean_distance_matrix(self.locations, self.locations).tolist())
+
+    def test_eviction(self):
+        cache = MatrixCache(max_entries=4)
+
+        cache.matrix('distance', self.locations[:2], euclidean_distance_matrix)
+        cache.matrix('distance', self.locations[2:3], euclidean_distance_matrix)
+
+        self.assertEqual(len(cache.entries['distance']['keys']), 4)
+        _, stats = cache.matrix('distance', self.locations[2:3], euclidean_distance_matrix)
+        self.assertEqual(stats['hit_rate'], 1.0)
+
+    def test_location_eviction(self):
+        cache = MatrixCache(max_entries=4)
+
+        cache.matrix('distance', self.locations[:2], euclidean_distance_matrix)
+        cache.matrix('distance', self.locations[2:3], euclidean_distance_matrix)
+        cache.matrix('distance', self.locations[1:3], euclidean_distance_matrix)
+
+        # The first location is no longer part of any pair
+        self.assertEqual(sorted(cache.location_ids.values()), [1, 2])
+
+        matrix, _ = cache.matrix('distance', self.locations, euclidean_distance_matrix)
+        self.assertEqual(matrix, euclidean_distance_matrix(self.locations, self.locations).tolist())
+        self.assertEqual(len(cache.entries['distance']['keys']), 4)
+
+    def test_euclidean_not_cached(self):
+        request = VrpRequest(id='1', locations=self.locations, depot=0, num_vehicles=1, message_type='TSP',
+                             max_distance=100000, cost_coefficient=100)
+        cache = MatrixCache()
+
+        matrix = generate_distance_matrix(request, cache=cache)
+
+        self.assertEqual(matrix, [[euclidean_distance(p, q) for q in self.locations] for p in self.locations])
+        self.assertEqual(cache.entries, {})
+
+        cache = MatrixCache(euclidean=True)
+        self.assertEqual(generate_distance_matrix(request, cache=cache), matrix)
+        self.assertEqual(len(cache.entries['euclidean_distance']['keys']), 9)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.pickle')
+            cache = MatrixCache(path=path)
+            cache.matrix('distance', self.locations, euclidean_distance_matrix)
+            cache.save()
+
+            _, stats = MatrixCache(path=path).matrix('distance', self.locations, euclidean_distance_matrix)
+
+        self.assertEqual(stats['hit_rate'], 1.0)
+
+    def test_source_change(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.pickle')
+            cache = MatrixCache(path=path)
+            cache.bind('road_distance', 'graph-1')
+            cache.matrix('road_distance', self.locations, euclidean_distance_matrix)
+            cache.save()
+
+            # Same road graph after a restart
+            cache = MatrixCache(path=path)
+            cache.bind('road_distance', 'graph-1')
+            _, stats = cache.matrix('road_distance', self.locations, euclidean_distance_matrix)
+            self.assertEqual(stats['hit_rate'], 1.0)
+
+            # The road graph was replaced
+            cache = MatrixCache(path=path)
+            with self.assertLogs(level='WARNING'):
+                cache.bind('road_distance', 'graph-2')
+            self.assertEqual(cache.location_ids, {})
+            _, stats = cache.matrix('road_distance', self.locations, euclidean_distance_matrix)
+            self.assertEqual(stats['hit_rate'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from tsp_solver.utils.preprocessing import collapse_locations, expand_routes
+
+
+class TestCollapseLocations(unittest.TestCase):
+
+    def test_exact_duplicates(self):
+        locations = [{'latitude': 0.0, 'longitude': 0.0},
+                     {'latitude': 1.0, 'longitude': 1.0},
+                     {'latitude': 2.0, 'longitude': 2.0},
+                     {'latitude': 1.0, 'longitude': 1.0}]
+
+        result = collapse_locations(locations, 0)
+
+        self.assertEqual(result['groups'], [[0], [1, 3], [2]])
+        self.assertEqual(result['locations'], locations[:3])
+        self.assertEqual(result['depot'], 0)
+
+    def test_depot_is_not_merged(self):
+        locations = [{'latitude': 1.0, 'longitude': 1.0},
+                     {'latitude': 1.0, 'longitude': 1.0},
+                     {'latitude': 1.0, 'longitude': 1.0}]
+
+        result = collapse_locations(locations, 1)
+
+        self.assertEqual(result['groups'], [[0, 2], [1]])
+        self.assertEqual(result['depot'], 1)
+
+    def test_tolerance(self):
+        locations = [{'latitude': 0.0, 'longitude': 0.0},
+                     {'latitude': 1.0001, 'longitude': 1.0},
+                     {'latitude': 1.0002, 'longitude': 1.0}]
+
+        self.assertEqual(collapse_locations(locations, 0)['groups'], [[0], [1], [2]])
+        self.assertEqual(collapse_locations(locations, 0, tolerance=0.01)['groups'], [[0], [1, 2]])
+
+    def test_time_windows(self):
+        locations = [{'latitude': 0.0, 'longitude': 0.0},
+                     {'latitude': 1.0, 'longitude': 1.0},
+                     {'latitude': 1.0, 'longitude': 1.0},
+                     {'latitude': 1.0, 'longitude': 1.0}]
+        time_windows = [[0, 30], [0, 10], [5, 15], [20, 25]]
+
+        result = collapse_locations(locations, 0, time_windows)
+
+        self.assertEqual(result['groups'], [[0], [1, 2], [3]])
+        self.assertEqual(result['time_windows'], [[0, 30], [5, 10], [20, 25]])
+
+    def test_expand_routes(self):
+        groups = [[0], [1, 3], [2]]
+        solution = {
+            'routes': [{'route': [0, 2, 1, 0], 'time_windows': [[0, 0], [3, 4], [6, 7], [9, 9]],
+                        'vehicle': 0, 'route_time': 9}],
+            'total_time': 9
+        }
+
+        result = expand_routes(solution, groups)
+
+        self.assertEqual(result['routes'][0]['route'], [0, 2, 1, 3, 0])
+        self.assertEqual(result['routes'][0]['time_windows'], [[0, 0], [3, 4], [6, 7], [6, 7], [9, 9]])
+
+    def test_expand_routes_arrival_times(self):
+        groups = [[0], [1, 3], [2]]
+        solution = {
+            'routes': [{'route': [0, 2, 1, 0], 'arrival_times': [0, 3, 6, 9], 'vehicle': 0, 'route_time': 9}],
+            'total_time': 9
+        }
+
+        result = expand_routes(solution, groups)
+
+        self.assertEqual(result['routes'][0]['arrival_times'], [0, 3, 6, 6, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from tsp_solver.utils.road_network import RoadNetwork
+
+
+class TestRoadNetwork(unittest.TestCase):
+
+    def setUp(self):
+        # Path graph 0 <-> 1 <-> 2 <-> 3 with a one-way shortcut 0 -> 3
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'graph.npz')
+        np.savez(self.path,
+                 indptr=np.array([0, 2, 4, 6, 7]),
+                 indices=np.array([1, 3, 0, 2, 1, 3, 2]),
+                 distance=np.array([10, 25, 10, 10, 10, 10, 10]),
+                 duration=np.array([1, 5, 1, 1, 1, 1, 1]),
+                 latitude=np.array([0.0, 0.0, 0.0, 0.0]),
+                 longitude=np.array([0.0, 1.0, 2.0, 3.0]))
+        self.locations = [{'latitude': 0.1, 'longitude': 0.1},
+                          {'latitude': 0.0, 'longitude': 2.9},
+                          {'latitude': -0.1, 'longitude': 1.1}]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_distance_matrix(self):
+        road_network = RoadNetwork(self.path)
+
+        result = road_network.distance_matrix(self.locations, self.locations)
+
+        self.assertEqual(result.tolist(), [[0, 25, 10], [30, 0, 20], [10, 20, 0]])
+
+    def test_worker_processes(self):
+        # Path graph of 40 nodes, whose sources are solved in several chunks
+        size = 40
+        indices = [[node - 1, node + 1] for node in range(size)]
+        indices = [[neighbour for neighbour in neighbours if 0 <= neighbour < size] for neighbours in indices]
+        path = os.path.join(self.directory.name, 'path.npz')
+        np.savez(path,
+                 indptr=np.cumsum([0] + [len(neighbours) for neighbours in indices]),
+                 indices=np.concatenate(indices),
+                 distance=np.full(2 * size - 2, 10),
+                 duration=np.ones(2 * size - 2),
+                 latitude=np.zeros(size),
+                 longitude=np.arange(size, dtype=float))
+        locations = [{'latitude': 0.0, 'longitude': float(node)} for node in range(size)]
+
+        road_network = RoadNetwork(path, workers=2)
+        try:
+            result = road_network.distance_matrix(locations, locations)
+        finally:
+            road_network.close()
+
+        self.assertEqual(result.tolist(), [[10 * abs(i - j) for j in range(size)] for i in range(size)])
+        self.assertIsNone(road_network.pool)
+
+    def test_identity(self):
+        identity = RoadNetwork(self.path).identity
+        self.assertEqual(RoadNetwork(self.path).identity, identity)
+
+        with np.load(self.path) as data:
+            arrays = dict(data)
+        arrays['duration'] = arrays['duration'] * 2
+        np.savez(self.path, **arrays)
+
+        self.assertNotEqual(RoadNetwork(self.path).identity, identity)
+
+    def test_time_matrix(self):
+        road_network = RoadNetwork(self.path)
+
+        result = road_network.time_matrix(self.locations, self.locations)
+
+        self.assertEqual(result.tolist(), [[0, 3, 1], [3, 0, 2], [1, 2, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
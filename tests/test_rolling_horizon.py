@@ -0,0 +1,88 @@
+import unittest
+
+import numpy as np
+
+from tsp_solver.rolling_horizon import horizon_buckets, rolling_horizon_vrptw_solver
+
+
+def day_instance(size, seed=0):
+    random = np.random.default_rng(seed)
+    points = random.random((size, 2)) * 60
+    time_matrix = np.rint(np.hypot(*(points[:, None] - points[None]).transpose(2, 0, 1))).astype(int).tolist()
+    time_windows = [[int(opening), int(opening) + 60] for opening in random.integers(0, 600, size)]
+    time_windows[0] = [0, 0]
+    return time_matrix, time_windows
+
+
+class TestRollingHorizon(unittest.TestCase):
+
+    def test_horizon_buckets(self):
+        time_windows = [[0, 0], [10, 20], [250, 300], [130, 200]]
+
+        self.assertEqual(horizon_buckets(time_windows, 0, 100), [110, 210, 310])
+        self.assertEqual(horizon_buckets([[0, 0]], 0, 100), [100])
+
+    def test_feasible_routes(self):
+        time_matrix, time_windows = day_instance(40)
+
+        for horizon_overlap in (0, 60):
+            result = rolling_horizon_vrptw_solver(time_matrix, time_windows, 0, 8, 600, 1000, 120, horizon_overlap)
+
+            visited = sorted(location for route in result['routes'] for location in route['route'][1:-1])
+            self.assertEqual(visited, list(range(1, 40)))
+            self.assertEqual(result['total_time'], sum(route['route_time'] for route in result['routes']))
+
+            for route in result['routes']:
+                self.assertEqual(route['route'][0], 0)
+                self.assertEqual(route['route'][-1], 0)
+                arrivals = [earliest for earliest, _ in route['time_windows']]
+                for location, arrival in zip(route['route'][1:-1], arrivals[1:-1]):
+                    self.assertTrue(time_windows[location][0] <= arrival <= time_windows[location][1])
+                for origin, destination, departure, arrival in zip(route['route'], route['route'][1:], arrivals,
+                                                                   arrivals[1:]):
+                    self.assertGreaterEqual(arrival, departure + time_matrix[origin][destination])
+
+    def assert_wait_time(self, result, time_matrix, wait_time):
+        for route in result['routes']:
+            arrivals = [earliest for earliest, _ in route['time_windows']]
+            for origin, destination, departure, arrival in zip(route['route'][1:-1], route['route'][2:-1], arrivals[1:],
+                                                               arrivals[2:]):
+                self.assertLessEqual(arrival - departure - time_matrix[origin][destination], wait_time)
+
+    def test_wait_time(self):
+        # The routes are planned over five buckets, the vehicles carrying their arrival times across the buckets
+        for seed in (2, 3, 4):
+            time_matrix, time_windows = day_instance(30, seed)
+            time_windows[0] = [0, 1000]
+
+            with self.assertNoLogs(level='WARNING'):
+                result = rolling_horizon_vrptw_solver(time_matrix, time_windows, 0, 8, 20, 1000, 120, 60)
+
+            self.assertEqual(len(horizon_buckets(time_windows, 0, 120)), 5)
+            self.assert_wait_time(result, time_matrix, 20)
+
+    def test_whole_day_fallback(self):
+        time_matrix, time_windows = day_instance(30, 0)
+        time_windows[0] = [0, 1000]
+
+        with self.assertLogs(level='WARNING'):
+            result = rolling_horizon_vrptw_solver(time_matrix, time_windows, 0, 8, 20, 1000, 120, 60)
+
+        visited = sorted(location for route in result['routes'] for location in route['route'][1:-1])
+        self.assertEqual(visited, list(range(1, 30)))
+        self.assert_wait_time(result, time_matrix, 20)
+
+    def test_slim_response(self):
+        time_matrix, time_windows = day_instance(20)
+
+        result = rolling_horizon_vrptw_solver(time_matrix, time_windows, 0, 8, 600, 1000, 200,
+                                              include_slacks=False, include_empty_routes=False)
+
+        for route in result['routes']:
+            self.assertGreater(len(route['route']), 2)
+            self.assertEqual(len(route['arrival_times']), len(route['route']))
+            self.assertNotIn('time_windows', route)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from tsp_solver.utils.search_budget import SearchBudgetTuner, problem_bucket, time_to_improvement
+
+
+class TestSearchBudgetTuner(unittest.TestCase):
+
+    def test_problem_bucket(self):
+        self.assertEqual(problem_bucket('VRP', 20, 2), 'VRP:5:2:0.0')
+        self.assertEqual(problem_bucket('VRPTW', 20, 2, [[0, 100], [0, 10], [50, 60]]), 'VRPTW:5:2:0.5')
+
+    def test_time_to_improvement(self):
+        search_log = [(0.1, 1000), (0.5, 600), (2.0, 505), (8.0, 500)]
+
+        self.assertEqual(time_to_improvement(search_log, 10, 0.99), 2.0)
+        self.assertEqual(time_to_improvement(search_log, 8.5, 0.999), 17.0)
+
+    def test_exploring(self):
+        tuner = SearchBudgetTuner(max_time=30, min_samples=2)
+        tuner.record('VRP:5:2:0.0', [(0.1, 1000), (1.0, 500)], 30)
+
+        self.assertEqual(tuner.choose('VRP:5:2:0.0')['time_limit'], 30)
+
+    def test_learned(self):
+        tuner = SearchBudgetTuner(min_time=1, max_time=30, min_samples=2, quantile=1.0)
+        tuner.record('VRP:5:2:0.0', [(0.1, 1000), (2.0, 500)], 30)
+        tuner.record('VRP:5:2:0.0', [(0.1, 1000), (4.0, 500)], 30)
+        tuner.record('VRP:5:2:0.0', [(0.1, 1000), (0.2, 500)], 30)
+
+        self.assertEqual(tuner.choose('VRP:5:2:0.0')['time_limit'], 4.0)
+        self.assertEqual(tuner.choose('VRP:6:2:0.0')['time_limit'], 30)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tuner.json')
+            tuner = SearchBudgetTuner(min_samples=1, path=path)
+            tuner.record('VRP:5:2:0.0', [(0.1, 1000), (2.0, 500)], 30)
+            tuner.save()
+
+            self.assertEqual(SearchBudgetTuner(min_samples=1, path=path).choose('VRP:5:2:0.0')['time_limit'], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
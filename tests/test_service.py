@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tsp_solver import service
+from tsp_solver.service import restart_consumer, signal_readiness
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FailingConsumer:
+
+    def __init__(self):
+        self.channel = FakeChannel()
+        self.drained = False
+        self.closed = False
+
+    async def consume(self):
+        raise KeyError('longitude')
+
+    async def drain(self, timeout):
+        self.drained = True
+
+    async def close(self):
+        # Called before the channel is closed, while the pending responses can still be published
+        self.closed = not self.channel.closed
+
+
+class TestService(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.restart_delay = service.restart_delay
+        service.restart_delay = 0
+
+    def tearDown(self):
+        service.restart_delay = self.restart_delay
+
+    async def test_restart_failed_consumer(self):
+        consumer = FailingConsumer()
+        task = asyncio.create_task(consumer.consume())
+        await asyncio.wait([task])
+
+        async def start():
+            return 'new consumer'
+
+        with self.assertLogs(level='ERROR') as logs:
+            new_consumer = await restart_consumer(consumer, task, start, drain_timeout=1)
+
+        self.assertEqual(new_consumer, 'new consumer')
+        self.assertTrue(consumer.drained)
+        self.assertTrue(consumer.closed)
+        self.assertTrue(consumer.channel.closed)
+        self.assertIn("KeyError: 'longitude'", logs.output[0])
+
+    def test_worker_readiness(self):
+        with tempfile.TemporaryDirectory() as directory:
+            readiness_file = os.path.join(directory, 'ready')
+            ready_event = multiprocessing.Event()
+
+            with mock.patch.dict(os.environ, {'TSP_READINESS_FILE': readiness_file}):
+                # Worker processes only signal their readiness to the parent process
+                signal_readiness(True, ready_event)
+                self.assertTrue(ready_event.is_set())
+                self.assertFalse(os.path.exists(readiness_file))
+
+                signal_readiness(False, ready_event)
+                self.assertFalse(ready_event.is_set())
+
+                signal_readiness(True)
+                self.assertTrue(os.path.exists(readiness_file))
+                signal_readiness(False)
+                self.assertFalse(os.path.exists(readiness_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
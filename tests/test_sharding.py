@@ -0,0 +1,188 @@
+import asyncio
+import json
+import unittest
+from collections import Counter
+
+from aiormq.exceptions import DeliveryError
+from pamqp.commands import Basic
+
+from tests.test_dispatcher import FakeMessage, vrp_request
+from tsp_solver.coordinator import ShardCoordinator
+from tsp_solver.router import ShardRouter
+from tsp_solver.utils.sharding import geohash, region_key, shard_of, assign_shards, shard_queue_name
+
+
+class RoutedMessage(FakeMessage):
+
+    headers = None
+    content_type = None
+    delivery_mode = None
+    correlation_id = None
+    reply_to = None
+    message_id = None
+
+
+class RecordingExchange:
+
+    def __init__(self):
+        self.published = []
+        self.nack = False
+
+    async def publish(self, message, routing_key):
+        if self.nack:
+            raise DeliveryError(None, Basic.Nack())
+        self.published.append((routing_key, json.loads(message.body.decode())))
+        return Basic.Ack()
+
+
+class RecordingChannel:
+
+    def __init__(self):
+        self.default_exchange = RecordingExchange()
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class NamedQueue:
+
+    name = 'TSP_INPUT_QUEUE'
+
+
+class FakeShardConsumer:
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.channel = RecordingChannel()
+        self.stopped = asyncio.Event()
+        self.cache_stats = {'hits': 0, 'lookups': 0}
+        self.closed = False
+
+    async def consume(self):
+        await self.stopped.wait()
+
+    async def drain(self, timeout):
+        self.stopped.set()
+
+    async def close(self):
+        self.closed = True
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_geohash(self):
+        self.assertEqual(geohash(42.605, -5.603, 5), 'ezs42')
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_region_key(self):
+        data = vrp_request('1')
+        data['depot'] = 1
+
+        self.assertEqual(region_key(data), geohash(data['locations'][1]['latitude'],
+                                                   data['locations'][1]['longitude']))
+        self.assertEqual(region_key({'message_type': 'VRP'}), '')
+
+    def test_consistent_shards(self):
+        regions = ['region-{}'.format(i) for i in range(5000)]
+        before = [shard_of(region, 10) for region in regions]
+        after = [shard_of(region, 11) for region in regions]
+
+        self.assertEqual(set(before), set(range(10)))
+        self.assertLess(max(Counter(before).values()), 600)
+        moved = [shard for shard_before, shard in zip(before, after) if shard_before != shard]
+        self.assertEqual(set(moved), {10})
+        self.assertLess(len(moved), 600)
+
+    def test_rendezvous_assignment(self):
+        members = ['a', 'b', 'c', 'd']
+        assignment = assign_shards(32, members)
+
+        self.assertEqual(sorted(shard for shards in assignment.values() for shard in shards), list(range(32)))
+
+        # Only the shards of the leaving member move
+        remaining = assign_shards(32, members[:3])
+        for member in members[:3]:
+            self.assertTrue(set(assignment[member]) <= set(remaining[member]))
+
+
+class TestShardRouter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.channel = RecordingChannel()
+        self.control_exchange = RecordingExchange()
+        self.router = ShardRouter(channel=self.channel, queue=NamedQueue(), control_exchange=self.control_exchange,
+                                  num_shards=8)
+
+    async def test_route_request(self):
+        data = vrp_request('1')
+        message = RoutedMessage(data)
+
+        await self.router.process_incoming_message(message)
+
+        shard = shard_of(region_key(data), 8)
+        self.assertEqual(self.channel.default_exchange.published, [(shard_queue_name('TSP_INPUT_QUEUE', shard), data)])
+        self.assertEqual(message.result, 'ack')
+
+    async def test_requeue_on_broker_nack(self):
+        self.channel.default_exchange.nack = True
+        message = RoutedMessage(vrp_request('1'))
+
+        await self.router.process_incoming_message(message)
+
+        self.assertEqual(message.result, 'requeue')
+
+    async def test_broadcast_cancellation(self):
+        data = {'message_type': 'CANCEL', 'request_id': '1'}
+
+        await self.router.process_incoming_message(RoutedMessage(data))
+
+        self.assertEqual(self.control_exchange.published, [('', data)])
+        self.assertEqual(self.channel.default_exchange.published, [])
+
+
+class TestShardCoordinator(unittest.IsolatedAsyncioTestCase):
+
+    async def start_shard(self, shard):
+        self.started.append(shard)
+        return FakeShardConsumer(shard)
+
+    def setUp(self):
+        self.started = []
+        self.control_exchange = RecordingExchange()
+        self.coordinator = ShardCoordinator(channel=RecordingChannel(), queue=None,
+                                            control_exchange=self.control_exchange, start_shard=self.start_shard,
+                                            num_shards=16, member_id='a')
+        self.coordinator.joined = True
+
+    async def announce(self, message_type, member):
+        await self.coordinator.process_message(FakeMessage({'message_type': message_type, 'member': member}))
+        await asyncio.gather(*self.coordinator.releasing)
+
+    async def test_rebalance_on_membership_changes(self):
+        await self.coordinator.rebalance()
+        self.assertEqual(sorted(self.coordinator.shards), list(range(16)))
+
+        await self.announce('MEMBER', 'b')
+        self.assertEqual(sorted(self.coordinator.shards), assign_shards(16, ['a', 'b'])['a'])
+
+        await self.announce('LEAVE', 'b')
+        self.assertEqual(sorted(self.coordinator.shards), list(range(16)))
+
+        # The shards which came back are consumed by new consumers
+        self.assertEqual(len(self.started), 16 + len(assign_shards(16, ['a', 'b'])['b']))
+
+    async def test_drain_releases_all_shards(self):
+        await self.coordinator.rebalance()
+        consumers = [consumer for consumer, _ in self.coordinator.shards.values()]
+
+        await self.coordinator.drain(timeout=1)
+
+        self.assertEqual(self.coordinator.shards, {})
+        self.assertTrue(all(consumer.channel.closed for consumer in consumers))
+        self.assertTrue(all(consumer.closed for consumer in consumers))
+        self.assertEqual(self.control_exchange.published[-1], ('', {'message_type': 'LEAVE', 'member': 'a'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
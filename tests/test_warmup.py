@@ -0,0 +1,14 @@
+import unittest
+
+from tsp_solver.dispatcher import Dispatcher
+from tsp_solver.warmup import warm_up
+
+
+class TestWarmUp(unittest.TestCase):
+
+    def test_warm_up(self):
+        self.assertIs(warm_up(), Dispatcher)
+
+
+if __name__ == '__main__':
+    unittest.main()
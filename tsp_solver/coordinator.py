@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+import aio_pika
+from aio_pika.message import IncomingMessage
+from aio_pika.queue import Queue
+from aio_pika.channel import Channel
+from aio_pika.exchange import Exchange
+
+from tsp_solver.utils.abstract_consumer import RabbitMQConsumer
+from tsp_solver.utils.sharding import assign_shards
+
+
+class ShardCoordinator(RabbitMQConsumer):
+    """
+    Consumes the shards assigned to this worker. The workers announce themselves with heartbeats on the control
+    exchange, and every worker assigns the shards among the live workers with rendezvous hashing. A consumer, e.g. a
+    Dispatcher, is started for every assigned shard, and drained once the shard moves to another worker. The shard
+    queues have a single active consumer, so a shard taken over is consumed only once its previous consumer left.
+    """
+
+    def __init__(self, channel: Channel, queue: Queue, control_exchange: Exchange, start_shard, num_shards: int,
+                 member_id: str = None, heartbeat_interval: float = 5.0, drain_timeout: float = 30.0):
+        """
+        :param channel: aio_pika channel
+        :param queue: The queue of this worker bound to the control exchange
+        :param control_exchange: The fanout exchange of the control messages
+        :param start_shard: Coroutine function creating the consumer of a shard
+        :param num_shards: Number of shards
+        :param member_id: Id of this worker. Defaults to a unique id based on the host and the process.
+        :param heartbeat_interval: Time between two heartbeats (In seconds). Workers not heard for three heartbeats
+            are considered gone.
+        :param drain_timeout: Time given to the messages being processed when a shard moves (In seconds)
+        """
+        super().__init__(channel=channel, queue=queue, iterator_timeout=heartbeat_interval, iterator_timeout_sleep=0)
+
+        self.control_exchange = control_exchange
+        self.start_shard = start_shard
+        self.num_shards = num_shards
+        self.member_id = member_id or '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.heartbeat_interval = heartbeat_interval
+        self.drain_timeout = drain_timeout
+
+        # Last heartbeat time of every known worker
+        self.members = {self.member_id: time.monotonic()}
+
+        # Consumer and consuming task of every assigned shard, and the releases of the shards which moved
+        self.shards = {}
+        self.releasing = set()
+        self.rebalancing = asyncio.Lock()
+
+        # Shards are assigned once the other workers had one heartbeat to announce themselves
+        self.joined = False
+        self.heartbeat_task = None
+        self.reported_lookups = {}
+
+    async def consume(self):
+        """
+        Send heartbeats in the background, and process the heartbeats of the other workers until `stop_consuming()`
+        is called.
+        """
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+
+        await super().consume()
+
+    async def process_message(self, message: IncomingMessage):
+        try:
+            json_data = json.loads(message.body.decode('utf-8'))
+        except ValueError:
+            return
+
+        # Other control messages, e.g. cancellations, are processed by the shard consumers
+        member = json_data.get('member') if isinstance(json_data, dict) else None
+        if not member or member == self.member_id:
+            return
+
+        if json_data.get('message_type') == 'MEMBER':
+            joining = member not in self.members
+            self.members[member] = time.monotonic()
+            if joining:
+                logging.info("Worker {} joined".format(member))
+                await self.rebalance()
+        elif json_data.get('message_type') == 'LEAVE' and member in self.members:
+            del self.members[member]
+            logging.info("Worker {} left".format(member))
+            await self.rebalance()
+
+    async def heartbeat(self):
+        """
+        Announce this worker periodically, forget the workers which stopped announcing themselves, and report the
+        matrix cache efficiency of every shard.
+        """
+        while self.consuming_flag:
+            try:
+                await self.announce('MEMBER')
+            except Exception:
+                logging.exception("Could not send the heartbeat of worker {}".format(self.member_id))
+            await asyncio.sleep(self.heartbeat_interval)
+
+            now = time.monotonic()
+            for member, seen in list(self.members.items()):
+                if member != self.member_id and now - seen > 3 * self.heartbeat_interval:
+                    del self.members[member]
+                    logging.info("Worker {} timed out".format(member))
+
+            self.joined = True
+            await self.rebalance()
+            self.report()
+
+    async def announce(self, message_type: str):
+        """
+        Publish a membership message on the control exchange
+        :param message_type: MEMBER or LEAVE
+        """
+        body = json.dumps({'message_type': message_type, 'member': self.member_id})
+        await self.control_exchange.publish(
+            aio_pika.Message(body=body.encode(), expiration=3 * self.heartbeat_interval), routing_key='')
+
+    async def rebalance(self):
+        """
+        Start consuming the shards newly assigned to this worker, and release the shards assigned to other workers.
+        """
+        if not self.joined or not self.consuming_flag:
+            return
+
+        async with self.rebalancing:
+            assigned = set(assign_shards(self.num_shards, sorted(self.members))[self.member_id])
+            released = sorted(set(self.shards) - assigned)
+            started = sorted(assigned - set(self.shards))
+
+            # The shards are released in the background, their new consumers waiting for them as standby consumers
+            for shard in released:
+                release = asyncio.create_task(self.release(shard, *self.shards.pop(shard)))
+                self.releasing.add(release)
+                release.add_done_callback(self.releasing.discard)
+
+            for shard in started:
+                consumer = await self.start_shard(shard)
+                self.shards[shard] = (consumer, asyncio.create_task(consumer.consume()))
+
+            if released or started:
+                logging.info("Worker {} consuming shards {} of {} with {} workers".format(
+                    self.member_id, sorted(self.shards), self.num_shards, len(self.members)))
+
+    async def release(self, shard: int, consumer, task):
+        """
+        Drain the consumer of a shard and close its channel
+        :param shard: Shard number
+        :param consumer: The shard consumer
+        :param task: The consuming task of the shard consumer
+        """
+        await consumer.drain(self.drain_timeout)
+        await asyncio.gather(task, return_exceptions=True)
+        await consumer.close()
+        await consumer.channel.close()
+
+        logging.info("Worker {} released shard {}".format(self.member_id, shard))
+
+    def report(self):
+        """
+        Log the matrix cache hit rate of every shard which had requests since the last report.
+        """
+        for shard, (consumer, _) in sorted(self.shards.items()):
+            cache_stats = getattr(consumer, 'cache_stats', None)
+            if not cache_stats or cache_stats['lookups'] in (0, self.reported_lookups.get(shard)):
+                continue
+
+            self.reported_lookups[shard] = cache_stats['lookups']
+            logging.info("Shard {} matrix cache hit rate {:.1%} over {} lookups".format(
+                shard, cache_stats['hits'] / cache_stats['lookups'], cache_stats['lookups']))
+
+    async def drain(self, timeout: float):
+        """
+        Leave the workers, and drain the consumers of all shards.
+        :param timeout: Time to wait for the messages being processed (In seconds)
+        """
+        self.stop_consuming()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+        try:
+            await self.announce('LEAVE')
+        except Exception:
+            logging.exception("Could not announce the leave of worker {}".format(self.member_id))
+
+        async with self.rebalancing:
+            shards, self.shards = self.shards, {}
+            self.drain_timeout = timeout
+            await asyncio.gather(*[self.release(shard, consumer, task) for shard, (consumer, task) in shards.items()],
+                                 *self.releasing)
+
+        await super().drain(timeout)
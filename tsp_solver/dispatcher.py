@@ -1,25 +1,157 @@
+import asyncio
+import functools
 import json
+import os
 import logging
+import threading
+import time
+from collections import OrderedDict
+
 import aio_pika
 
 from aio_pika.message import IncomingMessage
 from aio_pika.queue import Queue
 from aio_pika.channel import Channel
 
-from tsp_solver.utils.abstract_consumer import RabbitMQConsumer
+from tsp_solver.utils.abstract_consumer import RabbitMQConsumer, message_expired, message_published_at
 from tsp_solver.vrp_solver import ortools_vrp_solver
 from tsp_solver.vrptw_solver import ortools_vrptw_solver
+from tsp_solver.rolling_horizon import rolling_horizon_vrptw_solver
 from tsp_solver.utils.helpers import generate_distance_matrix, generate_time_matrix
-from tsp_solver.utils.models import VrpRequest, VrptwRequest, VrpResponse
+from tsp_solver.utils.preprocessing import collapse_locations, expand_routes
+from tsp_solver.utils.road_network import RoadNetwork
+from tsp_solver.utils.matrix_cache import MatrixCache
+from tsp_solver.utils.search_budget import SearchBudgetTuner, problem_bucket
+from tsp_solver.utils.lower_bound import vrp_lower_bound
+from tsp_solver.utils.publisher import OutboundPublisher
+from tsp_solver.utils.profiling import RequestProfiler, ProfileCaptures
+from tsp_solver.utils.models import VrpRequest, VrptwRequest, VrpResponse, CancelRequest, ProfileRequest
+
+# Maximum number of remembered cancellations of requests which are not received yet
+max_pending_cancellations = 10000
+
+
+@functools.lru_cache(maxsize=None)
+def load_road_network():
+    """
+    Load the road network once per process, if configured. Otherwise, Euclidean matrices are used.
+    """
+    road_network_file = os.environ.get('ROAD_NETWORK_FILE')
+    if not road_network_file:
+        return None
+
+    return RoadNetwork(road_network_file, int(os.environ.get('ROAD_NETWORK_WORKERS', 1)))
+
+
+def close_road_network():
+    """
+    Shut down the worker processes of the road network, if it was loaded.
+    """
+    if load_road_network.cache_info().currsize:
+        road_network = load_road_network()
+        if road_network is not None:
+            road_network.close()
+
+
+@functools.lru_cache(maxsize=None)
+def load_matrix_cache():
+    """
+    Create the cross-request cache of location pairs once per process, optionally persisted on the disk.
+    """
+    if os.environ.get('MATRIX_CACHE', 'true').lower() != 'true':
+        return None
+
+    cache = MatrixCache(max_entries=int(os.environ.get('MATRIX_CACHE_SIZE', 1000000)),
+                        path=os.environ.get('MATRIX_CACHE_FILE'),
+                        euclidean=os.environ.get('MATRIX_CACHE_EUCLIDEAN', 'false').lower() == 'true')
+
+    # The road matrices persisted from another road graph are discarded
+    road_network = load_road_network()
+    if road_network is not None:
+        cache.bind('road_distance', road_network.identity)
+        cache.bind('road_time', road_network.identity)
+
+    return cache
+
+
+@functools.lru_cache(maxsize=None)
+def load_profile_captures():
+    """
+    Create the pending profiling captures once per process, shared by all consumers of the process.
+    """
+    return ProfileCaptures()
+
+
+@functools.lru_cache(maxsize=None)
+def load_search_budget_tuner():
+    """
+    Create the search budget tuner once per process, if enabled. Its state is optionally persisted on the disk.
+    """
+    if os.environ.get('SEARCH_BUDGET_TUNER', 'false').lower() != 'true':
+        return None
+
+    return SearchBudgetTuner(min_time=float(os.environ.get('SEARCH_BUDGET_MIN', 1)),
+                             max_time=float(os.environ.get('SEARCH_BUDGET_MAX', 30)),
+                             path=os.environ.get('SEARCH_BUDGET_FILE'))
 
 
 class Dispatcher(RabbitMQConsumer):
     """
     Message dispatcher class for handling incoming messages
     """
-    def __init__(self, channel: Channel, queue: Queue):
+
+    # Incoming messages are acked once their responses are confirmed by the broker
+    auto_ack = False
+
+    def __init__(self, channel: Channel, queue: Queue, control_queue: Queue = None):
         super().__init__(channel=channel, queue=queue)
 
+        # Queue receiving control messages, e.g. cancellations
+        self.control_queue = control_queue
+
+        # Cancel events of the requests being solved, and reception times of the cancellations of requests not
+        # received yet. Those expire after the longest expected queueing time of a request.
+        self.in_flight = {}
+        self.cancelled = OrderedDict()
+        self.cancellation_ttl = float(os.environ.get('CANCELLATION_TTL', 600))
+
+        # The road network and the matrix cache are shared by all consumers of the process
+        self.road_network = load_road_network()
+        self.matrix_cache = load_matrix_cache()
+        self.search_budget_tuner = load_search_budget_tuner()
+
+        # Hits and lookups of the matrix cache by the requests of this consumer, e.g. reported per shard
+        self.cache_stats = {'hits': 0, 'lookups': 0}
+
+        # Set once the solves are aborted to drain the consumer
+        self.aborting = False
+
+        # Pending profiling captures requested through control messages
+        self.profile_directory = os.environ.get('PROFILE_DIR', 'profiles')
+        self.profile_captures = load_profile_captures()
+
+        # Maximum time spent on the lower bound of a request with an optimality gap (In seconds)
+        self.lower_bound_time = float(os.environ.get('LOWER_BOUND_TIME', 1))
+
+        # Bounds of the search time limits, including the time limits requested by the clients
+        self.min_search_time = float(os.environ.get('SEARCH_BUDGET_MIN', 1))
+        self.max_search_time = float(os.environ.get('SEARCH_BUDGET_MAX', 30))
+
+        # Responses are published in the background, so that solving does not wait for the broker
+        self.publisher = OutboundPublisher(self.channel.default_exchange, 'TSP_OUTPUT_QUEUE',
+                                           buffer_size=int(os.environ.get('TSP_PUBLISH_BUFFER', 100)),
+                                           batch_size=int(os.environ.get('TSP_PUBLISH_BATCH', 20)))
+        self.publish_timeout = float(os.environ.get('TSP_PUBLISH_TIMEOUT', 10))
+
+    async def consume(self):
+        """
+        Consume control messages in the background, and requests until `stop_consuming()` is called.
+        """
+        if self.control_queue is not None:
+            await self.control_queue.consume(self.process_control_message)
+
+        await super().consume()
+
     async def process_message(self, message: IncomingMessage):
         # Load message data as json
         json_data = json.loads(message.body.decode('utf-8'))
@@ -28,49 +160,260 @@ class Dispatcher(RabbitMQConsumer):
         message_type = json_data.get('message_type')
         message_id = json_data.get('id')
 
+        # Cancellations of pending requests may also be sent on the input queue
+        if message_type == 'CANCEL':
+            await self.process_cancel_message(json_data)
+            await message.ack()
+            return
+
         # Dispatch request based on message type
         try:
-            if message_type in ['VRP', 'TSP']:
-                request = VrpRequest(**json_data)
-                response = self.process_vrp_message(request)
+            if message_expired(message):
+                response = VrpResponse(message_id, None, 408, "Request expired.")
+            elif self.pending_cancellation(str(message_id), message):
+                response = VrpResponse(message_id, None, 499, "Request cancelled.")
+            elif message_type in ['VRP', 'TSP']:
+                profiler = self.start_profiling(json_data)
+                request = self.parse_request(VrpRequest, json_data, profiler)
+                response = await self.run_solver(self.process_vrp_message, request, profiler)
             elif message_type == 'VRPTW':
-                request = VrptwRequest(**json_data)
-                response = self.process_vrptw_message(request)
+                profiler = self.start_profiling(json_data)
+                request = self.parse_request(VrptwRequest, json_data, profiler)
+                response = await self.run_solver(self.process_vrptw_message, request, profiler)
             else:
                 response = VrpResponse(message_id, None, 400, "Not supported message type.")
         except ValueError as e:
             response = VrpResponse(message_id, None, 400, str(e))
 
+        # The solve was aborted to drain the consumer, so give the message back to the broker
+        if response is None:
+            await message.nack(requeue=True)
+            return
+
         # Construct response message
         outbound_message = json.dumps(response.__dict__)
 
-        # Publish response message
-        await self.channel.default_exchange.publish(
+        # Publish response message, the incoming message is acked once the response is confirmed
+        await self.publisher.publish(
             aio_pika.Message(
                 body=outbound_message.encode(),
                 correlation_id=str(message_id),
                 reply_to=str(message_id)
             ),
-            routing_key='TSP_OUTPUT_QUEUE',
+            message
         )
 
-    def process_vrptw_message(self, request):
+    async def process_control_message(self, message: IncomingMessage):
+        """
+        Process incoming control message
+        :param message: Received message
+        """
+        async with message.process():
+            json_data = json.loads(message.body.decode('utf-8'))
+
+            if json_data.get('message_type') == 'CANCEL':
+                await self.process_cancel_message(json_data)
+            elif json_data.get('message_type') == 'PROFILE':
+                self.process_profile_message(json_data)
+
+    def process_profile_message(self, json_data):
+        """
+        Process incoming profiling message, which enables profiling for the next matching requests
+        :param json_data: Message data
+        """
+        try:
+            request = ProfileRequest(**json_data)
+        except ValueError as e:
+            logging.warning("Invalid profiling message: {}".format(e))
+            return
+
+        # Every consumer of the process receives the message, which is identified by its id or else its content
+        key = request.id if request.id is not None else json.dumps(json_data, sort_keys=True)
+        if self.profile_captures.add(key, request.count, request.match):
+            logging.info("Profiling of the next {} requests matching {} enabled".format(request.count, request.match))
+
+    def start_profiling(self, json_data):
+        """
+        Create a profiler if the request asks for profiling or matches a pending profiling capture
+        :param json_data: Request data
+        :return: The profiler, or None if the request is not profiled
+        """
+        if not json_data.get('profile') and not self.profile_captures.take(json_data):
+            return None
+
+        return RequestProfiler(self.profile_directory, json_data.get('id'))
+
+    @staticmethod
+    def parse_request(model, json_data, profiler=None):
+        """
+        Parse the request data, under the profiler if any
+        :param model: Request model class
+        :param json_data: Request data
+        :param profiler: Optional request profiler
+        :return: The request
+        """
+        if profiler is None:
+            return model(**json_data)
+
+        with profiler:
+            return model(**json_data)
+
+    async def process_cancel_message(self, json_data):
+        """
+        Process incoming cancellation message
+        :param json_data: Message data
+        """
+        try:
+            request = CancelRequest(**json_data)
+        except ValueError as e:
+            logging.warning("Invalid cancellation message: {}".format(e))
+            return
+
+        self.cancel_request(request.request_id)
+
+    def cancel_request(self, request_id):
+        """
+        Abort the solve of a request if it is in flight, otherwise drop the request once it is received
+        :param request_id: Id of the request to be cancelled
+        """
+        cancel_event = self.in_flight.get(request_id)
+        if cancel_event is not None:
+            cancel_event.set()
+        else:
+            now = time.time()
+            self.cancelled[request_id] = now
+            self.cancelled.move_to_end(request_id)
+
+            # Forget the expired cancellations, the oldest ones first
+            while self.cancelled and (len(self.cancelled) > max_pending_cancellations or
+                                      now - next(iter(self.cancelled.values())) > self.cancellation_ttl):
+                self.cancelled.popitem(last=False)
+
+        logging.info("Cancellation of request with id {} received".format(request_id))
+
+    def pending_cancellation(self, request_id: str, message: IncomingMessage):
+        """
+        Check whether a request was cancelled before it was received. The cancellation does not apply once expired, nor
+        to a request published after it, e.g. a request sent again with the same id.
+        :param request_id: Id of the request
+        :param message: The request message
+        :return: True if the request is cancelled
+        """
+        cancelled_at = self.cancelled.pop(request_id, None)
+        if cancelled_at is None or time.time() - cancelled_at > self.cancellation_ttl:
+            return False
+
+        published_at = message_published_at(message)
+        return published_at is None or published_at <= cancelled_at
+
+    async def run_solver(self, handler, request, profiler=None):
+        """
+        Run a request handler in a worker thread, so that the control messages are still processed meanwhile
+        :param handler: Request handler, process_vrp_message or process_vrptw_message
+        :param request: Request message
+        :param profiler: Optional request profiler
+        :return: Response of the handler, a cancelled response, or None if aborted to drain the consumer
+        """
+        cancel_event = threading.Event()
+        self.in_flight[request.id] = cancel_event
+
+        if profiler is not None:
+            handler = functools.partial(profiler.runcall, handler)
+
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(None, handler, request, cancel_event,
+                                                                        profiler)
+        finally:
+            self.in_flight.pop(request.id, None)
+
+            if profiler is not None:
+                logging.info("Profile of request with id {} written to {}".format(request.id, profiler.save()))
+
+        if cancel_event.is_set():
+            if self.aborting:
+                return None
+            response = VrpResponse(request.id, None, 499, "Request cancelled.")
+
+        return response
+
+    async def abort_processing(self):
+        """
+        Abort the in-flight solves once the drain timeout passed. Their messages are requeued.
+        """
+        if not self.in_flight:
+            await super().abort_processing()
+            return
+
+        self.aborting = True
+        for cancel_event in self.in_flight.values():
+            cancel_event.set()
+
+    def process_vrptw_message(self, request, cancel_event=None, profiler=None):
         """
         Process incoming message against the TSP optimization engine
         :param request: Request data
+        :param cancel_event: Optional event aborting the solve once set
+        :param profiler: Optional request profiler receiving the search log
         """
 
+        # Merge coincident stops with compatible time windows into a single node
+        groups = None
+        if request.collapse_duplicates:
+            reduced = collapse_locations(request.locations, request.depot, request.time_windows,
+                                         request.duplicate_tolerance)
+            groups = reduced['groups']
+            request = request.copy(update={'locations': reduced['locations'],
+                                           'depot': reduced['depot'],
+                                           'time_windows': reduced['time_windows']})
+
         # Generate the time matrix
-        time_matrix = generate_time_matrix(request)
+        time_matrix = generate_time_matrix(request, self.road_network, self.matrix_cache, self.cache_stats)
+
+        # Choose the search time limit. The searches of rolling horizon buckets are not learnt by the tuner.
+        bucket = None
+        if request.horizon_length is None:
+            bucket = problem_bucket(request.message_type, len(request.locations), request.num_vehicles,
+                                    request.time_windows)
+        budget = self.choose_search_budget(request, bucket)
+        search_log = profiler.search_log if profiler is not None else ([] if budget is not None else None)
 
         try:
-            # Solve the problem using time matrix
-            routes = ortools_vrptw_solver(time_matrix=time_matrix,
-                                          time_windows=request.time_windows,
-                                          depot=request.depot,
-                                          num_vehicles=request.num_vehicles,
-                                          wait_time=request.wait_time,
-                                          max_time_vehicle=request.max_time_vehicle)
+            # Solve the problem using time matrix, either at once or bucket by bucket over the planning day
+            if request.horizon_length is not None:
+                routes = rolling_horizon_vrptw_solver(time_matrix=time_matrix,
+                                                      time_windows=request.time_windows,
+                                                      depot=request.depot,
+                                                      num_vehicles=request.num_vehicles,
+                                                      wait_time=request.wait_time,
+                                                      max_time_vehicle=request.max_time_vehicle,
+                                                      horizon_length=request.horizon_length,
+                                                      horizon_overlap=request.horizon_overlap,
+                                                      cancel_event=cancel_event,
+                                                      time_limit=budget['time_limit'] if budget is not None else None,
+                                                      search_log=search_log,
+                                                      log_search=profiler is not None and profiler.log_search,
+                                                      include_slacks=request.include_slacks,
+                                                      include_empty_routes=request.include_empty_routes)
+            else:
+                routes = ortools_vrptw_solver(time_matrix=time_matrix,
+                                              time_windows=request.time_windows,
+                                              depot=request.depot,
+                                              num_vehicles=request.num_vehicles,
+                                              wait_time=request.wait_time,
+                                              max_time_vehicle=request.max_time_vehicle,
+                                              cancel_event=cancel_event,
+                                              time_limit=budget['time_limit'] if budget is not None else None,
+                                              search_log=search_log,
+                                              log_search=profiler is not None and profiler.log_search,
+                                              include_slacks=request.include_slacks,
+                                              include_empty_routes=request.include_empty_routes)
+
+            # Learn from the objective versus time curve of the solve
+            self.record_search(routes, bucket, budget, search_log, cancel_event)
+
+            # Map the reduced nodes back to the original location indices
+            if groups is not None:
+                routes = expand_routes(routes, groups)
 
             # Construct response
             response = VrpResponse(request.id, routes, 200, "Operation successful.")
@@ -82,14 +425,34 @@ class Dispatcher(RabbitMQConsumer):
 
         return response
 
-    def process_vrp_message(self, request):
+    def process_vrp_message(self, request, cancel_event=None, profiler=None):
         """
         Process incoming message against the VRP/TSP optimization engine
         :param request: Request message
+        :param cancel_event: Optional event aborting the solve once set
+        :param profiler: Optional request profiler receiving the search log
         """
 
+        # Merge coincident stops into a single node
+        groups = None
+        if request.collapse_duplicates:
+            reduced = collapse_locations(request.locations, request.depot, tolerance=request.duplicate_tolerance)
+            groups = reduced['groups']
+            request = request.copy(update={'locations': reduced['locations'], 'depot': reduced['depot']})
+
         # Generate distance matrix
-        distance_matrix = generate_distance_matrix(request)
+        distance_matrix = generate_distance_matrix(request, self.road_network, self.matrix_cache, self.cache_stats)
+
+        # Bound the objective, to stop the search once the solution is within the requested gap
+        lower_bound = None
+        if request.optimality_gap is not None:
+            lower_bound = vrp_lower_bound(distance_matrix, request.depot, request.num_vehicles,
+                                          request.cost_coefficient, max_time=self.lower_bound_time)
+
+        # Choose the search time limit
+        bucket = problem_bucket(request.message_type, len(request.locations), request.num_vehicles)
+        budget = self.choose_search_budget(request, bucket)
+        search_log = profiler.search_log if profiler is not None else ([] if budget is not None else None)
 
         try:
             # Solve the problem using generated distance matrix
@@ -97,7 +460,21 @@ class Dispatcher(RabbitMQConsumer):
                                         depot=request.depot,
                                         num_vehicles=request.num_vehicles,
                                         max_distance=request.max_distance,
-                                        cost_coefficient=request.cost_coefficient)
+                                        cost_coefficient=request.cost_coefficient,
+                                        cancel_event=cancel_event,
+                                        time_limit=budget['time_limit'] if budget is not None else None,
+                                        search_log=search_log,
+                                        log_search=profiler is not None and profiler.log_search,
+                                        include_empty_routes=request.include_empty_routes,
+                                        lower_bound=lower_bound,
+                                        optimality_gap=request.optimality_gap)
+
+            # Learn from the objective versus time curve of the solve
+            self.record_search(routes, bucket, budget, search_log, cancel_event)
+
+            # Map the reduced nodes back to the original location indices
+            if groups is not None:
+                routes = expand_routes(routes, groups)
 
             # Construct response
             response = VrpResponse(request.id, routes, 200, "Operation successful.")
@@ -108,3 +485,63 @@ class Dispatcher(RabbitMQConsumer):
         logging.info("Incoming {} request with id {} processed".format(request.message_type, request.id))
 
         return response
+
+    def choose_search_budget(self, request, bucket):
+        """
+        Choose the search time limit of a request, either requested by the client or chosen by the tuner
+        :param request: Request message
+        :param bucket: Bucket of the problem, or None if the problem is not tuned
+        :return: Json object containing the time limit and the reason of the choice, or None for no time limit
+        """
+        if request.time_limit is not None:
+            time_limit = min(max(request.time_limit, self.min_search_time), self.max_search_time)
+            if time_limit != request.time_limit:
+                return {'time_limit': time_limit,
+                        'reason': "Requested by the client, clamped from {}s to the bounds [{}s, {}s].".format(
+                            request.time_limit, self.min_search_time, self.max_search_time)}
+            return {'time_limit': time_limit, 'reason': "Requested by the client."}
+
+        if self.search_budget_tuner is not None and bucket is not None:
+            return self.search_budget_tuner.choose(bucket)
+
+        return None
+
+    def record_search(self, routes, bucket, budget, search_log, cancel_event):
+        """
+        Report the chosen search budget in the solution, and record the search of the solve in the tuner
+        :param routes: The solution
+        :param bucket: Bucket of the problem, or None if the problem is not tuned
+        :param budget: The chosen search budget
+        :param search_log: List of (elapsed time, objective) pairs of the solutions found
+        :param cancel_event: Optional event aborting the solve once set
+        """
+        if budget is None:
+            return
+
+        routes['search_budget'] = budget
+
+        if self.search_budget_tuner is not None and bucket is not None and \
+                (cancel_event is None or not cancel_event.is_set()):
+            self.search_budget_tuner.record(bucket, search_log, budget['time_limit'])
+
+    async def on_stop(self):
+        """
+        Wait for the pending responses to be confirmed before the prefetched messages are requeued.
+        """
+        await self.close()
+
+    async def close(self):
+        """
+        Publish the pending responses within the publishing timeout, and stop the background publishing.
+        """
+        await self.publisher.close(self.publish_timeout)
+
+    async def on_finish(self):
+        """
+        Persist the matrix cache and the search budget tuner once the consumer gets idle.
+        """
+        if self.matrix_cache is not None:
+            self.matrix_cache.save()
+
+        if self.search_budget_tuner is not None:
+            self.search_budget_tuner.save()
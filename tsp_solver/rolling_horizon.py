@@ -0,0 +1,189 @@
+import logging
+import threading
+
+from tsp_solver.vrptw_solver import ortools_vrptw_solver
+
+
+def horizon_buckets(time_windows, depot: int, horizon_length: int):
+    """
+    Slice the planning day into consecutive time buckets, based on the opening times of the location time windows
+    :param time_windows: An array of time windows for the locations.
+    :param depot: The index of the depot.
+    :param horizon_length: Length of a bucket, in the unit of the time windows
+    :return: List of the end times of the buckets
+    """
+    openings = [time_window[0] for location, time_window in enumerate(time_windows) if location != depot]
+    if not openings:
+        return [time_windows[depot][0] + horizon_length]
+
+    first, last = min(openings), max(openings)
+    num_buckets = (last - first) // horizon_length + 1
+
+    return [first + (bucket + 1) * horizon_length for bucket in range(num_buckets)]
+
+
+def rolling_horizon_vrptw_solver(time_matrix: list[list[int]],
+                                 time_windows: list[list[int]],
+                                 depot: int,
+                                 num_vehicles: int,
+                                 wait_time: int,
+                                 max_time_vehicle: int,
+                                 horizon_length: int,
+                                 horizon_overlap: int = 0,
+                                 cancel_event: threading.Event = None,
+                                 time_limit: float = None,
+                                 search_log: list = None,
+                                 log_search: bool = False,
+                                 include_slacks: bool = True,
+                                 include_empty_routes: bool = True):
+    """
+    Solve the VRP with time windows bucket by bucket over the planning day. Each bucket contains the locations opening
+    within it, plus the locations opening within the overlap after it. The vehicles start every bucket from their last
+    committed location and arrival time, and only the visits of the bucket's own locations preceding any look-ahead location
+    are committed, the other locations being left to the next bucket. The last bucket brings the vehicles back to the
+    depot. If the committed routes leave a bucket without solution, the whole day is solved at once instead.
+    :param time_matrix: An array of travel times between locations.
+    :param time_windows: An array of time windows for the locations.
+    :param depot: The index of the depot.
+    :param num_vehicles: The number of vehicles in the fleet.
+    :param wait_time: An upper bound for slack (the wait times at the locations).
+    :param max_time_vehicle: An upper bound for the total time over each vehicle's route.
+    :param horizon_length: Length of a bucket, in the unit of the time windows.
+    :param horizon_overlap: Look-ahead of every bucket into the next one, in the unit of the time windows.
+    :param cancel_event: Optional event aborting the search once set.
+    :param time_limit: Optional search time limit (In seconds), shared equally by the buckets.
+    :param search_log: Optional list receiving the (elapsed time, objective) pair of every solution found.
+    :param log_search: Whether the ortools search log should be written to the standard error.
+    :param include_slacks: Whether the [earliest, latest] times of every stop are included in the result, rather than
+        only the earliest arrival times.
+    :param include_empty_routes: Whether the routes of unused vehicles are included in the result.
+    :return: Json object containing the merged routes
+    """
+
+    # Validate inputs
+    assert len(time_matrix) == len(time_matrix[0]), "The time matrix does not have equal rows and columns."
+    assert depot >= 0, "depot should be greater than or equal to zero."
+    assert horizon_length > 0, "Horizon length should be greater than zero."
+    assert horizon_overlap >= 0, "Horizon overlap should be greater than or equal to zero."
+
+    bucket_ends = horizon_buckets(time_windows, depot, horizon_length)
+    bucket_time_limit = time_limit / len(bucket_ends) if time_limit is not None else None
+
+    # State of every vehicle carried from one bucket to the next
+    positions = [depot] * num_vehicles
+    start_windows = [time_windows[depot]] * num_vehicles
+    visits = [[] for _ in range(num_vehicles)]
+    depot_times = [None] * num_vehicles
+
+    pending = [location for location in range(len(time_matrix)) if location != depot]
+
+    for bucket, bucket_end in enumerate(bucket_ends):
+        last = bucket == len(bucket_ends) - 1
+        if last:
+            core, lookahead = pending, []
+        else:
+            core = [location for location in pending if time_windows[location][0] < bucket_end]
+            lookahead = [location for location in pending
+                         if bucket_end <= time_windows[location][0] < bucket_end + horizon_overlap]
+            if not core:
+                continue
+
+        if cancel_event is not None and cancel_event.is_set():
+            raise Exception("Search cancelled.")
+
+        # Sub-problem over the vehicle positions and the bucket locations. Except in the last bucket, the routes end
+        # at a dummy location reachable from anywhere at no cost.
+        nodes = list(dict.fromkeys(positions + ([depot] if last else []) + core + lookahead))
+        local = {location: node for node, location in enumerate(nodes)}
+        sub_matrix = [[time_matrix[origin][destination] for destination in nodes] for origin in nodes]
+        sub_windows = [time_windows[location] for location in nodes]
+
+        if last:
+            ends = [local[depot]] * num_vehicles
+        else:
+            for row in sub_matrix:
+                row.append(0)
+            sub_matrix.append([0] * (len(nodes) + 1))
+            sub_windows.append([0, max_time_vehicle])
+            ends = [len(nodes)] * num_vehicles
+
+        starts = [local[position] for position in positions]
+        try:
+            result = ortools_vrptw_solver(sub_matrix, sub_windows, starts[0], num_vehicles, wait_time,
+                                          max_time_vehicle,
+                                          cancel_event=cancel_event,
+                                          time_limit=bucket_time_limit,
+                                          search_log=search_log,
+                                          log_search=log_search,
+                                          starts=starts,
+                                          ends=ends,
+                                          start_windows=start_windows)
+        except Exception:
+            if cancel_event is not None and cancel_event.is_set():
+                raise
+
+            # The committed routes may leave no vehicle able to reach the remaining locations without waiting longer
+            # than allowed, the whole day is then solved at once with the remaining time
+            logging.warning("Rolling horizon bucket {} has no solution, solving the whole day at once".format(bucket))
+            remaining_time_limit = (bucket_time_limit * (len(bucket_ends) - bucket)
+                                    if bucket_time_limit is not None else None)
+            return ortools_vrptw_solver(time_matrix, time_windows, depot, num_vehicles, wait_time, max_time_vehicle,
+                                        cancel_event=cancel_event,
+                                        time_limit=remaining_time_limit,
+                                        search_log=search_log,
+                                        log_search=log_search,
+                                        include_slacks=include_slacks,
+                                        include_empty_routes=include_empty_routes)
+
+        # Commit the visits of the bucket's own locations, up to the first look-ahead location
+        core_locations = set(core)
+        for route in result['routes']:
+            vehicle = route['vehicle']
+            for node, time_window in zip(route['route'][1:-1], route['time_windows'][1:-1]):
+                if nodes[node] not in core_locations:
+                    break
+                # The vehicles leave the depot in the bucket of their first committed visit
+                if depot_times[vehicle] is None:
+                    depot_times[vehicle] = route['time_windows'][0]
+                visits[vehicle].append((nodes[node], time_window))
+                positions[vehicle] = nodes[node]
+                # The vehicles leave at the slack of their start, which is bounded by the wait time like at any stop
+                start_windows[vehicle] = [time_window[0], time_window[0]]
+
+            if last:
+                if depot_times[vehicle] is None:
+                    depot_times[vehicle] = route['time_windows'][0]
+                visits[vehicle].append((depot, route['time_windows'][-1]))
+
+        committed = {location for vehicle_visits in visits for location, _ in vehicle_visits}
+        pending = [location for location in pending if location not in committed]
+
+        logging.debug("Rolling horizon bucket {} solved with {} locations, {} pending".format(
+            bucket, len(core) + len(lookahead), len(pending)))
+
+    # Merge the committed visits into the usual response format
+    total_time = 0
+    routes = []
+    for vehicle in range(num_vehicles):
+        route = [depot] + [location for location, _ in visits[vehicle]]
+        times = [depot_times[vehicle]] + [time_window for _, time_window in visits[vehicle]]
+        route_time = times[-1][0]
+        total_time += route_time
+
+        if not include_empty_routes and len(route) <= 2:
+            continue
+
+        routes.append({
+            "route": route,
+            "vehicle": vehicle,
+            "route_time": route_time
+        })
+        if include_slacks:
+            routes[-1]["time_windows"] = times
+        else:
+            routes[-1]["arrival_times"] = [time_window[0] for time_window in times]
+
+    return {
+        "routes": routes,
+        "total_time": total_time
+    }
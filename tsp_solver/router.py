@@ -0,0 +1,80 @@
+import json
+import logging
+
+import aio_pika
+from pamqp.commands import Basic
+from aio_pika.message import IncomingMessage
+from aio_pika.queue import Queue
+from aio_pika.channel import Channel
+from aio_pika.exchange import Exchange
+
+from tsp_solver.utils.abstract_consumer import RabbitMQConsumer
+from tsp_solver.utils.sharding import region_key, shard_of, shard_queue_name
+
+
+class ShardRouter(RabbitMQConsumer):
+    """
+    Front stage of the sharded topology. It republishes every request of the input queue to the queue of the shard of
+    its region, i.e. the geohash of its depot, so that the requests of a region are solved by the same consumer and
+    find its caches warm. Cancellations are broadcast on the control exchange, since their request may be in any
+    shard.
+    """
+
+    def __init__(self, channel: Channel, queue: Queue, control_exchange: Exchange, num_shards: int,
+                 precision: int = 4):
+        """
+        :param channel: aio_pika channel, with publisher confirms
+        :param queue: The input queue
+        :param control_exchange: The fanout exchange of the control messages
+        :param num_shards: Number of shards
+        :param precision: Number of characters of the region geohashes
+        """
+        super().__init__(channel=channel, queue=queue)
+
+        self.control_exchange = control_exchange
+        self.num_shards = num_shards
+        self.precision = precision
+
+    async def process_message(self, message: IncomingMessage):
+        try:
+            json_data = json.loads(message.body.decode('utf-8'))
+        except ValueError:
+            json_data = {}
+
+        # Messages without a valid depot go to the shard of the empty region, whose consumer handles them as usual
+        if not isinstance(json_data, dict):
+            json_data = {}
+
+        # The request is acked once the broker confirmed its republishing, and requeued otherwise. With publisher
+        # confirms, a broker nack is raised by the publishing.
+        try:
+            if json_data.get('message_type') == 'CANCEL':
+                confirmation = await self.control_exchange.publish(aio_pika.Message(body=message.body),
+                                                                   routing_key='')
+            else:
+                shard = shard_of(region_key(json_data, self.precision), self.num_shards)
+
+                # The message properties are kept, e.g. the timestamp and expiration of the request
+                confirmation = await self.channel.default_exchange.publish(
+                    aio_pika.Message(
+                        body=message.body,
+                        headers=message.headers,
+                        content_type=message.content_type,
+                        delivery_mode=message.delivery_mode,
+                        correlation_id=message.correlation_id,
+                        reply_to=message.reply_to,
+                        expiration=message.expiration,
+                        message_id=message.message_id,
+                        timestamp=message.timestamp
+                    ),
+                    routing_key=shard_queue_name(self.queue.name, shard)
+                )
+        except Exception:
+            logging.exception("Routing of message {} failed".format(message.correlation_id))
+            await message.nack(requeue=True)
+            return
+
+        if confirmation is not None and not isinstance(confirmation, Basic.Ack):
+            logging.warning("Routing of message {} was not confirmed by the broker: {!r}".format(
+                message.correlation_id, confirmation))
+            await message.nack(requeue=True)
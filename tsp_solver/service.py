@@ -1,16 +1,214 @@
 import asyncio
+import functools
 import os
+import signal
 import sys
+import time
 import logging
-import aio_pika
+import multiprocessing
+import multiprocessing.connection
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from tsp_solver.dispatcher import Dispatcher
+# Heavy modules (aio_pika, ortools, numpy, pydantic) are imported once the service starts, the solver modules being
+# imported and warmed up in the background while connecting to the broker
+started_at = time.monotonic()
 
 # Configure logging settings
 logging.basicConfig(filename='../tsp_solver.log', level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
 
 
-async def start_service(consumer_class) -> None:
+# Shard queues are consumed by a single consumer at a time, the other consumers waiting as standby consumers
+shard_queue_arguments = {'x-single-active-consumer': True}
+
+# Time waited before restarting a failed consumer or worker process (In seconds)
+restart_delay = 1.0
+
+# Time between two checks of the readiness of the worker processes (In seconds)
+readiness_interval = 0.5
+
+
+async def start_consumer(consumer_class, connection, prefetch_count: int, input_queue_name: str = None,
+                         queue_arguments: dict = None):
+    """
+    Create a consumer on its own channel
+    :param consumer_class: The consumer class
+    :param connection: RabbitMQ connection
+    :param prefetch_count: Number of messages the consumer takes in advance
+    :param input_queue_name: Name of the consumed queue. Defaults to the input queue.
+    :param queue_arguments: Optional arguments of the consumed queue
+    :return: The consumer
+    """
+    import aio_pika
+
+    input_queue_name = input_queue_name or os.environ.get('TSP_INPUT_QUEUE', 'TSP_INPUT_QUEUE')
+    output_queue_name = os.environ.get('TSP_OUTPUT_QUEUE', 'TSP_OUTPUT_QUEUE')
+    control_exchange_name = os.environ.get('TSP_CONTROL_EXCHANGE', 'TSP_CONTROL_EXCHANGE')
+
+    # Creating channel, the broker confirms every published response
+    channel = await connection.channel(publisher_confirms=True)
+
+    # Will take no more than prefetch_count messages in advance
+    await channel.set_qos(prefetch_count=prefetch_count)
+
+    # Declaring queue
+    input_queue = await channel.declare_queue(input_queue_name, auto_delete=False, arguments=queue_arguments)
+    output_queue = await channel.declare_queue(output_queue_name)
+
+    # Every consumer receives all control messages through its own queue bound to the control exchange
+    control_exchange = await channel.declare_exchange(control_exchange_name, aio_pika.ExchangeType.FANOUT)
+    control_queue = await channel.declare_queue(exclusive=True)
+    await control_queue.bind(control_exchange)
+
+    # Setup consumer
+    return consumer_class(channel=channel, queue=input_queue, control_queue=control_queue)
+
+
+async def start_router(connection, prefetch_count: int, num_shards: int):
+    """
+    Create the router republishing the requests of the input queue to the shard queues
+    :param connection: RabbitMQ connection
+    :param prefetch_count: Number of messages the router takes in advance
+    :param num_shards: Number of shards
+    :return: The router
+    """
+    import aio_pika
+    from tsp_solver.router import ShardRouter
+    from tsp_solver.utils.sharding import shard_queue_name
+
+    input_queue_name = os.environ.get('TSP_INPUT_QUEUE', 'TSP_INPUT_QUEUE')
+    control_exchange_name = os.environ.get('TSP_CONTROL_EXCHANGE', 'TSP_CONTROL_EXCHANGE')
+
+    # The broker confirms every republished request before it is acked
+    channel = await connection.channel(publisher_confirms=True)
+    await channel.set_qos(prefetch_count=prefetch_count)
+
+    input_queue = await channel.declare_queue(input_queue_name, auto_delete=False)
+    for shard in range(num_shards):
+        await channel.declare_queue(shard_queue_name(input_queue_name, shard), auto_delete=False,
+                                    arguments=shard_queue_arguments)
+    control_exchange = await channel.declare_exchange(control_exchange_name, aio_pika.ExchangeType.FANOUT)
+
+    return ShardRouter(channel=channel, queue=input_queue, control_exchange=control_exchange, num_shards=num_shards,
+                       precision=int(os.environ.get('TSP_SHARD_PRECISION', 4)))
+
+
+async def start_coordinator(consumer_class, connection, prefetch_count: int, num_shards: int, drain_timeout: float):
+    """
+    Create the coordinator consuming the shards assigned to this process, each with its own consumer
+    :param consumer_class: The consumer class of the shards
+    :param connection: RabbitMQ connection
+    :param prefetch_count: Number of messages each shard consumer takes in advance
+    :param num_shards: Number of shards
+    :param drain_timeout: Time given to the messages being processed when a shard moves (In seconds)
+    :return: The coordinator
+    """
+    import aio_pika
+    from tsp_solver.coordinator import ShardCoordinator
+    from tsp_solver.utils.sharding import shard_queue_name
+
+    input_queue_name = os.environ.get('TSP_INPUT_QUEUE', 'TSP_INPUT_QUEUE')
+    control_exchange_name = os.environ.get('TSP_CONTROL_EXCHANGE', 'TSP_CONTROL_EXCHANGE')
+
+    channel = await connection.channel()
+
+    # The workers exchange their heartbeats through the control exchange
+    control_exchange = await channel.declare_exchange(control_exchange_name, aio_pika.ExchangeType.FANOUT)
+    membership_queue = await channel.declare_queue(exclusive=True)
+    await membership_queue.bind(control_exchange)
+
+    async def start_shard(shard):
+        return await start_consumer(consumer_class, connection, prefetch_count,
+                                    shard_queue_name(input_queue_name, shard), shard_queue_arguments)
+
+    return ShardCoordinator(channel=channel, queue=membership_queue, control_exchange=control_exchange,
+                            start_shard=start_shard, num_shards=num_shards,
+                            heartbeat_interval=float(os.environ.get('TSP_HEARTBEAT_INTERVAL', 5)),
+                            drain_timeout=drain_timeout)
+
+
+async def restart_consumer(consumer, task: asyncio.Task, start, drain_timeout: float):
+    """
+    Replace a consumer whose consuming stopped unexpectedly, e.g. because processing a message raised an exception.
+    The failed message was rejected, and the messages prefetched by the consumer are requeued once its channel closes.
+    :param consumer: The stopped consumer
+    :param task: Its consuming task
+    :param start: Coroutine function creating a new consumer
+    :param drain_timeout: Time given to the messages still being processed by the consumer, e.g. on its shards
+    :return: The new consumer
+    """
+    if task.cancelled():
+        logging.error('Consumer {!r} was cancelled, restarting it'.format(consumer))
+    elif task.exception() is not None:
+        logging.error('Consumer {!r} failed, restarting it'.format(consumer), exc_info=task.exception())
+    else:
+        logging.error('Consumer {!r} stopped unexpectedly, restarting it'.format(consumer))
+
+    try:
+        await consumer.drain(drain_timeout)
+        await consumer.close()
+        await consumer.channel.close()
+    except Exception:
+        logging.exception('Could not close the channel of consumer {!r}'.format(consumer))
+
+    await asyncio.sleep(restart_delay)
+
+    return await start()
+
+
+def signal_readiness(ready: bool, ready_event=None):
+    """
+    Create or remove the readiness file, if configured. Worker processes set or clear their readiness event instead,
+    the parent process creating the file once all of them are ready.
+    :param ready: Whether the service is ready to process messages
+    :param ready_event: Optional readiness event of the worker process
+    """
+    if ready_event is not None:
+        ready_event.set() if ready else ready_event.clear()
+        return
+
+    readiness_file = os.environ.get('TSP_READINESS_FILE')
+    if not readiness_file:
+        return
+
+    if ready:
+        with open(readiness_file, 'w') as file:
+            file.write(str(os.getpid()))
+    elif os.path.exists(readiness_file):
+        os.remove(readiness_file)
+
+
+async def start_service(consumer_class=None, num_consumers: int = 1, prefetch_count: int = 10,
+                        drain_timeout: float = 30.0, ready_event=None) -> None:
+    """
+    Run a number of consumers, each on its own channel, until SIGTERM or SIGINT is received. The consuming begins only
+    once the solver is warmed up, and the readiness is then signalled. On shutdown, the consumers are drained: they
+    stop taking new messages, and the messages being processed are finished or requeued within the drain timeout.
+    :param consumer_class: The consumer class. Defaults to the Dispatcher.
+    :param num_consumers: Number of consumers
+    :param prefetch_count: Number of messages each consumer takes in advance
+    :param drain_timeout: Time given to the messages being processed to be finished on shutdown (In seconds)
+    :param ready_event: Readiness event of the worker process, if the service runs in several processes
+    """
+    from tsp_solver.warmup import warm_up
+
+    loop = asyncio.get_running_loop()
+
+    # Every consumer solves its requests in a separate thread. With shards, every shard assigned to the process has its
+    # own consumer, so there are as many threads as shards, the threads being only created once needed.
+    num_shards = int(os.environ.get('TSP_SHARDS', 0))
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=num_shards if num_shards > 0 else num_consumers))
+
+    # Stop on termination signals
+    stopping = asyncio.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stopping.set)
+
+    # Warm up the solver in the background while connecting to the broker
+    warm_up_task = loop.run_in_executor(None, warm_up)
+
+    import aio_pika
+
     # Creat connection
     connection = await aio_pika.connect_robust(
         url="amqp://{}:{}@{}/".format(os.environ.get('MESSAGE_BROKER_USERNAME', 'admin'),
@@ -18,38 +216,125 @@ async def start_service(consumer_class) -> None:
                                       os.environ.get('MESSAGE_BROKER', 'localhost'))
     )
 
-    input_queue_name = os.environ.get('TSP_INPUT_QUEUE', 'TSP_INPUT_QUEUE')
-    output_queue_name = os.environ.get('TSP_OUTPUT_QUEUE', 'TSP_OUTPUT_QUEUE')
-
     try:
         async with connection:
-            # Creating channel
-            channel = await connection.channel()
+            dispatcher_class = await warm_up_task
+            consumer_class = consumer_class or dispatcher_class
+
+            # Without shards, all consumers share the input queue. Otherwise, the process may route the requests to the
+            # shard queues, and consumes the shards assigned to it.
+            if num_shards <= 0:
+                starters = [functools.partial(start_consumer, consumer_class, connection, prefetch_count)
+                            for _ in range(num_consumers)]
+            else:
+                starters = [functools.partial(start_coordinator, consumer_class, connection, prefetch_count,
+                                              num_shards, drain_timeout)]
+                if os.environ.get('TSP_ROUTER', 'true').lower() == 'true':
+                    starters.append(functools.partial(start_router, connection, prefetch_count, num_shards))
+            consumers = [await start() for start in starters]
+            tasks = {asyncio.create_task(consumer.consume()): index for index, consumer in enumerate(consumers)}
+            stopping_task = asyncio.create_task(stopping.wait())
 
-            # Will take no more than 10 messages in advance
-            await channel.set_qos(prefetch_count=10)
+            signal_readiness(True, ready_event)
+            logging.info('Service ready in {:.3f}s'.format(time.monotonic() - started_at))
 
-            # Declaring queue
-            input_queue = await channel.declare_queue(input_queue_name, auto_delete=False)
-            output_queue = await channel.declare_queue(output_queue_name)
+            # Restart the consumers which fail, until the service is stopped
+            while not stopping.is_set():
+                done, _ = await asyncio.wait(list(tasks) + [stopping_task], return_when=asyncio.FIRST_COMPLETED)
+                for task in done - {stopping_task}:
+                    index = tasks.pop(task)
+                    consumers[index] = await restart_consumer(consumers[index], task, starters[index], drain_timeout)
+                    tasks[asyncio.create_task(consumers[index].consume())] = index
 
-            # Setup consumer
-            consumer = consumer_class(channel=channel, queue=input_queue, )
+            logging.info('Draining {} consumers'.format(len(consumers)))
+            signal_readiness(False, ready_event)
 
-            await consumer.consume()
+            # Drain all consumers concurrently
+            stopping_task.cancel()
+            await asyncio.gather(*[consumer.drain(drain_timeout) for consumer in consumers])
+            for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    logging.error('Consumer {} failed while draining'.format(tasks[task]), exc_info=result)
     finally:
+        signal_readiness(False, ready_event)
         await connection.close()
 
+        # Stop the road network worker processes once the solving stopped
+        await asyncio.wait([warm_up_task])
+        from tsp_solver.dispatcher import close_road_network
+        close_road_network()
 
-def main():
-    logging.info('TSP solver service is going to be started.')
 
+def run_service(num_consumers: int, prefetch_count: int, drain_timeout: float, ready_event=None):
+    """
+    Run the service in the current process
+    """
     try:
-        asyncio.run(start_service(Dispatcher))
+        asyncio.run(start_service(None, num_consumers, prefetch_count, drain_timeout, ready_event))
     except asyncio.CancelledError:
         logging.info('Main task cancelled')
     except Exception as e:
-        logging.exception('Something unexpected happened: ', e)
+        logging.exception('Something unexpected happened: {}'.format(e))
+
+
+def start_worker(service_args, ready_event):
+    """
+    Start a worker process running the service
+    :param service_args: Arguments of run_service
+    :param ready_event: Event set by the worker process while it is ready
+    :return: The worker process
+    """
+    ready_event.clear()
+    process = multiprocessing.Process(target=run_service, args=service_args + (ready_event,))
+    process.start()
+    return process
+
+
+def main():
+    logging.info('TSP solver service is going to be started.')
+
+    num_processes = int(os.environ.get('TSP_PROCESSES', 1))
+    service_args = (int(os.environ.get('TSP_CONSUMERS', 1)),
+                    int(os.environ.get('TSP_PREFETCH_COUNT', 10)),
+                    float(os.environ.get('TSP_DRAIN_TIMEOUT', 30)))
+
+    try:
+        if num_processes == 1:
+            run_service(*service_args)
+            return
+
+        ready_events = [multiprocessing.Event() for _ in range(num_processes)]
+        processes = [start_worker(service_args, ready_event) for ready_event in ready_events]
+        stopping = threading.Event()
+
+        # Forward termination signals to the worker processes, which drain their consumers
+        def terminate(*_):
+            stopping.set()
+            signal_readiness(False)
+            for worker in processes:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGINT, terminate)
+
+        # Replace the worker processes which exit, until the service is stopped. The service is ready while all
+        # worker processes are.
+        ready = False
+        while processes:
+            multiprocessing.connection.wait([process.sentinel for process in processes], timeout=readiness_interval)
+            for index, process in enumerate(processes):
+                if process.is_alive() or stopping.is_set():
+                    continue
+                logging.error('Worker process {} exited with code {}, starting a new one'.format(
+                    process.pid, process.exitcode))
+                time.sleep(restart_delay)
+                processes[index] = start_worker(service_args, ready_events[index])
+
+            if stopping.is_set():
+                processes[:] = [process for process in processes if process.is_alive()]
+            elif ready != all(ready_event.is_set() for ready_event in ready_events):
+                ready = not ready
+                signal_readiness(ready)
     finally:
         logging.info("Shutdown complete")
 
@@ -1,5 +1,7 @@
 import asyncio
+import time
 from abc import ABCMeta, abstractmethod
+from datetime import timezone
 
 from aio_pika.message import IncomingMessage
 from aio_pika.queue import Queue
@@ -17,11 +19,36 @@ async def mark_message_processed(message: IncomingMessage):
         raise
 
 
+def message_published_at(message: IncomingMessage):
+    """
+    Get the publishing time of a message from its AMQP timestamp
+    :return: The publishing time as a Unix time, or None if the message has no timestamp
+    """
+    if message.timestamp is None:
+        return None
+
+    return message.timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def message_expired(message: IncomingMessage):
+    """
+    Check whether the AMQP expiration of a message passed while it was waiting to be processed. The expiration is
+    counted from the message timestamp, so messages without a timestamp never expire here.
+    """
+    if message.expiration is None or message.timestamp is None:
+        return False
+
+    return time.time() > message_published_at(message) + message.expiration
+
+
 class RabbitMQConsumer(metaclass=ABCMeta):
     """
     RabbitMQ consumer abstract class responsible for consuming data from the queue
     """
 
+    # Whether messages are acked once processed. Otherwise, process_message is responsible for acking them.
+    auto_ack = True
+
     def __init__(self, channel: Channel, queue: Queue, iterator_timeout: int = 5, iterator_timeout_sleep: float = 5.0, *args, **kwargs, ):
         """
         :param queue: aio_pika queue object
@@ -36,22 +63,33 @@ class RabbitMQConsumer(metaclass=ABCMeta):
         self.iterator_timeout = iterator_timeout
         self.iterator_timeout_sleep = iterator_timeout_sleep
         self.consuming_flag = True
+        self.processing_flag = False
+        self.consuming_task = None
 
     async def consume(self):
         """Consumes data from RabbitMQ queue forever until `stop_consuming()` is called."""
+        self.consuming_task = asyncio.current_task()
+
         async with self.queue.iterator(timeout=self.iterator_timeout) as queue_iterator:
             while self.consuming_flag:
                 try:
                     async for message in queue_iterator:
-                        async with message.process():
-                            # Process incoming message
-                            await self.process_message(message)
+                        # Give the messages received while stopping back to the broker
+                        if not self.consuming_flag:
+                            await message.nack(requeue=True)
+                            break
 
-                            if self.queue.name in message.body.decode():
-                                break
+                        self.processing_flag = True
+                        try:
+                            await self.process_incoming_message(message)
+                        finally:
+                            self.processing_flag = False
 
-                            if not self.consuming_flag:
-                                break
+                        if self.queue.name in message.body.decode():
+                            break
+
+                        if not self.consuming_flag:
+                            break
                 except asyncio.exceptions.TimeoutError:
                     await self.on_finish()
                     if self.consuming_flag:
@@ -59,6 +97,29 @@ class RabbitMQConsumer(metaclass=ABCMeta):
                 finally:
                     await self.on_finish()
 
+            # The queue iterator requeues the prefetched messages once closed
+            await self.on_stop()
+
+    async def process_incoming_message(self, message: IncomingMessage):
+        """
+        Process a message, then ack it if `auto_ack` is set. The message is rejected if the processing fails, and
+        requeued if the processing is aborted.
+        :param message: Received message
+        """
+        try:
+            await self.process_message(message)
+        except asyncio.CancelledError:
+            if not message.processed:
+                await message.nack(requeue=True)
+            raise
+        except Exception:
+            if not message.processed:
+                await message.reject(requeue=False)
+            raise
+
+        if self.auto_ack and not message.processed:
+            await message.ack()
+
     @abstractmethod
     async def process_message(self, message: IncomingMessage):
         """
@@ -73,8 +134,42 @@ class RabbitMQConsumer(metaclass=ABCMeta):
         """
         self.consuming_flag = False
 
+    async def drain(self, timeout: float):
+        """
+        Stops taking new messages, and waits for the message being processed to be finished. Once the timeout passes,
+        the processing is aborted through `abort_processing()`. An idle consumer stops within the iterator timeout.
+        :param timeout: Time to wait for the message being processed (In seconds)
+        """
+        self.stop_consuming()
+
+        if self.consuming_task is None or self.consuming_task.done():
+            return
+
+        done, _ = await asyncio.wait([self.consuming_task], timeout=max(timeout, self.iterator_timeout))
+        if not done:
+            await self.abort_processing()
+            await asyncio.wait([self.consuming_task])
+
+    async def abort_processing(self):
+        """
+        Aborts the message being processed once the drain timeout passed.
+        """
+        self.consuming_task.cancel()
+
     async def on_finish(self):
         """
         Called after the message consuming finished.
         """
         pass
+
+    async def on_stop(self):
+        """
+        Called once the consuming stopped, before the prefetched messages are requeued.
+        """
+        pass
+
+    async def close(self):
+        """
+        Release the resources of the consumer before its channel is closed, e.g. once its consuming failed.
+        """
+        pass
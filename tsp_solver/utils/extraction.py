@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def read_routes(solution, routing, manager):
+    """
+    Read the routes of a solution in one pass over the next pointers of all routing indices, instead of walking every
+    route through the solver objects node by node.
+    :param solution: The ortools routing solution object
+    :param routing: The routing object
+    :param manager: The manager object
+    :return: Tuple of the routing indices of every route (Starting and ending at the depot) and the array mapping the
+        routing indices to location indices
+    """
+    num_indices = manager.GetNumberOfIndices()
+    nodes = np.fromiter((manager.IndexToNode(index) for index in range(num_indices)), dtype=np.int64,
+                        count=num_indices)
+    nexts = [solution.Value(routing.NextVar(index)) for index in range(routing.Size())]
+
+    routes = []
+    for vehicle in range(routing.vehicles()):
+        index = routing.Start(vehicle)
+        end = routing.End(vehicle)
+        indices = [index]
+        while index != end:
+            index = nexts[index]
+            indices.append(index)
+        routes.append(np.array(indices, dtype=np.int64))
+
+    return routes, nodes
+
+
+def read_cumuls(solution, dimension, num_indices: int, include_max: bool = True):
+    """
+    Read the cumul values of a dimension for all routing indices in one pass
+    :param solution: The ortools routing solution object
+    :param dimension: The routing dimension
+    :param num_indices: Number of routing indices, including the route ends
+    :param include_max: Whether the upper bounds of the cumul values are read as well, which doubles the solver calls
+    :return: Tuple of the arrays of lower and upper bounds. The upper bounds are None if not included.
+    """
+    cumuls = [dimension.CumulVar(index) for index in range(num_indices)]
+    minimums = np.fromiter((solution.Min(cumul) for cumul in cumuls), dtype=np.int64, count=num_indices)
+    maximums = None
+    if include_max:
+        maximums = np.fromiter((solution.Max(cumul) for cumul in cumuls), dtype=np.int64, count=num_indices)
+
+    return minimums, maximums
+
+
+def is_empty_route(route) -> bool:
+    """
+    Check whether a route goes from the depot straight back to the depot, i.e. its vehicle is unused
+    :param route: Routing or location indices of the route
+    :return: True if the route does not visit any location
+    """
+    return len(route) <= 2
@@ -1,5 +1,8 @@
+import logging
 import math
 
+import numpy as np
+
 # Scale factor used for scale distances
 distance_scale_factor = 100
 vehicle_speed_constant = 80
@@ -30,25 +33,105 @@ def euclidean_time(p, q):
         return 0
 
 
-def generate_distance_matrix(request):
+def coordinates(locations):
+    """
+    Convert a list of locations into latitude and longitude arrays
+    :param locations: List of locations
+    :return: Latitude and longitude arrays
+    """
+    return (np.array([location['latitude'] for location in locations], dtype=float),
+            np.array([location['longitude'] for location in locations], dtype=float))
+
+
+def euclidean_distance_matrix(sources, targets):
+    """
+    Vectorized version of euclidean_distance computing the distances between two lists of locations
+    :param sources: List of origin locations
+    :param targets: List of destination locations
+    :return: Matrix whose i, j entry is the distance from sources[i] to targets[j]
+    """
+    source_lat, source_lon = coordinates(sources)
+    target_lat, target_lon = coordinates(targets)
+    distances = np.sqrt((source_lat[:, None] - target_lat[None, :]) ** 2 +
+                        (source_lon[:, None] - target_lon[None, :]) ** 2) * distance_scale_factor
+    return distances.astype(np.int64)
+
+
+def euclidean_time_matrix(sources, targets):
+    """
+    Vectorized version of euclidean_time computing the travel times between two lists of locations
+    :param sources: List of origin locations
+    :param targets: List of destination locations
+    :return: Matrix whose i, j entry is the time needed to travel from sources[i] to targets[j]
+    """
+    source_lat, source_lon = coordinates(sources)
+    target_lat, target_lon = coordinates(targets)
+    distances = np.sqrt((source_lat[:, None] - target_lat[None, :]) ** 2 +
+                        (source_lon[:, None] - target_lon[None, :]) ** 2) * distance_scale_factor
+    with np.errstate(divide='ignore'):
+        times = np.where(distances == 0, 0, vehicle_speed_constant / distances)
+    return times.astype(np.int64)
+
+
+def cached_matrix(request, kind, compute, cache, cache_stats=None):
+    """
+    Build a matrix through the cross-request cache, and report the cache efficiency
+    :param request: Request message
+    :param kind: Name of the matrix kind
+    :param compute: Function computing the matrix between a list of sources and a list of targets
+    :param cache: The matrix cache
+    :param cache_stats: Optional dict accumulating the hits and lookups of the cache
+    :return: The matrix
+    """
+    matrix, stats = cache.matrix(kind, request.locations, compute)
+
+    if cache_stats is not None:
+        cache_stats['hits'] = cache_stats.get('hits', 0) + stats['hits']
+        cache_stats['lookups'] = cache_stats.get('lookups', 0) + stats['lookups']
+
+    logging.info("Matrix cache for {} request {}: {} hit rate {:.1%}, computed in {:.3f}s, saved about {:.3f}s".format(
+        request.message_type, request.id, kind, stats['hit_rate'], stats['compute_time'], stats['time_saved']))
+
+    return matrix
+
+
+def generate_distance_matrix(request, road_network=None, cache=None, cache_stats=None):
     """
     This function generate the diagonal distance matrix
     :param request:
+    :param road_network: Optional road network used instead of the Euclidean distance
+    :param cache: Optional cross-request cache of location pairs
+    :param cache_stats: Optional dict accumulating the hits and lookups of the cache
     :return: Distance matrix
     """
-    distances = [[euclidean_distance(request.locations[i], request.locations[j]) for j in range(len(request.locations))]
-                 for i in range(len(request.locations))]
+    if road_network is not None:
+        if cache is not None:
+            return cached_matrix(request, 'road_distance', road_network.distance_matrix, cache, cache_stats)
+        return road_network.distance_matrix(request.locations, request.locations).tolist()
 
-    return distances
+    # The Euclidean matrices are computed faster than they are looked up, unless the cache is told otherwise
+    if cache is not None and cache.euclidean:
+        return cached_matrix(request, 'euclidean_distance', euclidean_distance_matrix, cache, cache_stats)
 
+    return euclidean_distance_matrix(request.locations, request.locations).tolist()
 
-def generate_time_matrix(request):
+
+def generate_time_matrix(request, road_network=None, cache=None, cache_stats=None):
     """
     This function generates diagonal time matrix
     :param request:
+    :param road_network: Optional road network used instead of the Euclidean time
+    :param cache: Optional cross-request cache of location pairs
+    :param cache_stats: Optional dict accumulating the hits and lookups of the cache
     :return: Time matrix
     """
-    times = [[euclidean_time(request.locations[i], request.locations[j]) for j in range(len(request.locations))]
-             for i in range(len(request.locations))]
+    if road_network is not None:
+        if cache is not None:
+            return cached_matrix(request, 'road_time', road_network.time_matrix, cache, cache_stats)
+        return road_network.time_matrix(request.locations, request.locations).tolist()
+
+    # The Euclidean matrices are computed faster than they are looked up, unless the cache is told otherwise
+    if cache is not None and cache.euclidean:
+        return cached_matrix(request, 'euclidean_time', euclidean_time_matrix, cache, cache_stats)
 
-    return times
+    return euclidean_time_matrix(request.locations, request.locations).tolist()
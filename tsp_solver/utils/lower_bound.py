@@ -0,0 +1,170 @@
+import math
+import time
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+
+def spanning_tree(weights):
+    """
+    Compute a minimum spanning tree of a complete graph with Prim's algorithm, which takes a quadratic time on dense
+    matrices, each step being a vectorised update of the distances of the nodes to the tree.
+    :param weights: Square matrix of symmetric edge weights, possibly negative or zero
+    :return: Tuple of the tree weight and the degree of every node in the tree
+    """
+    num_nodes = len(weights)
+    if num_nodes < 2:
+        return 0.0, np.zeros(num_nodes, dtype=np.int64)
+
+    in_tree = np.zeros(num_nodes, dtype=bool)
+    in_tree[0] = True
+    distances = weights[0].astype(float)
+    distances[0] = np.inf
+    parents = np.zeros(num_nodes, dtype=np.int64)
+    weight = 0.0
+
+    for _ in range(num_nodes - 1):
+        node = int(distances.argmin())
+        weight += distances[node]
+        in_tree[node] = True
+        distances[node] = np.inf
+
+        closer = ~in_tree & (weights[node] < distances)
+        distances[closer] = weights[node][closer]
+        parents[closer] = node
+
+    # Every node but the root is linked to its parent
+    degrees = np.bincount(parents[1:], minlength=num_nodes) + 1
+    degrees[0] -= 1
+
+    return weight, degrees
+
+
+def nearest_neighbour_tour(weights, start: int = 0):
+    """
+    Compute the length of the nearest neighbour tour, used as the upper bound of the subgradient steps
+    :param weights: Square matrix of symmetric edge weights
+    :param start: The first node of the tour
+    :return: Tour length
+    """
+    visited = np.zeros(len(weights), dtype=bool)
+    node, length = start, 0.0
+    for _ in range(len(weights) - 1):
+        visited[node] = True
+        distances = np.where(visited, np.inf, weights[node])
+        next_node = int(distances.argmin())
+        length += distances[next_node]
+        node = next_node
+
+    return length + weights[node, start]
+
+
+def one_tree_bound(weights, special: int = 0, iterations: int = 100, max_time: float = 1.0):
+    """
+    Compute the Held-Karp lower bound of a tour length: the weight of a minimum 1-tree (A spanning tree of all nodes
+    but the special one, plus its two cheapest edges), raised by subgradient optimisation of node penalties.
+    :param weights: Square matrix of symmetric edge weights
+    :param special: The special node of the 1-trees
+    :param iterations: Maximum number of subgradient iterations
+    :param max_time: Maximum computation time (In seconds)
+    :return: Lower bound of the length of any tour visiting all nodes
+    """
+    num_nodes = len(weights)
+    others = np.delete(np.arange(num_nodes), special)
+    started = time.monotonic()
+
+    upper_bound = nearest_neighbour_tour(weights, special)
+    penalties = np.zeros(num_nodes)
+    best_bound = -math.inf
+    step_scale, stalled = 2.0, 0
+
+    for _ in range(iterations):
+        penalized = weights + penalties[:, None] + penalties[None, :]
+
+        # Spanning tree of the other nodes, and the two cheapest edges of the special node
+        tree_weight, tree_degrees = spanning_tree(penalized[np.ix_(others, others)])
+        special_edges = np.argpartition(penalized[special, others], 1)[:2]
+
+        bound = tree_weight + penalized[special, others[special_edges]].sum() - 2 * penalties.sum()
+        if bound > best_bound:
+            best_bound, stalled = bound, 0
+        else:
+            stalled += 1
+
+        # Every node of a tour has degree two, the 1-tree is then an optimal tour
+        degrees = np.zeros(num_nodes, dtype=np.int64)
+        degrees[others] = tree_degrees
+        degrees[others[special_edges]] += 1
+        degrees[special] = 2
+        subgradient = degrees - 2
+        if not subgradient.any() or time.monotonic() - started > max_time:
+            break
+
+        # Penalize the nodes of too high degree, the step being halved whenever the bound stalls
+        if stalled >= 3:
+            step_scale, stalled = step_scale / 2, 0
+        penalties += step_scale * max(upper_bound - bound, 0) / (subgradient ** 2).sum() * subgradient
+
+    return best_bound
+
+
+def longest_round_trip(distances, depot: int):
+    """
+    Compute the longest shortest round trip from the depot to a location, which bounds the distance of the route
+    visiting that location
+    :param distances: Square matrix of distances
+    :param depot: The depot
+    :return: Length of the longest round trip
+    """
+    # Zero entries are treated as missing edges by scipy, they are replaced by negligible distances
+    graph = np.where(distances > 0, distances, 1e-9)
+    np.fill_diagonal(graph, 0)
+
+    round_trips = dijkstra(graph, indices=depot) + dijkstra(graph.T, indices=depot)
+
+    return round_trips.max()
+
+
+def vrp_lower_bound(distance_matrix, depot: int, num_vehicles: int, cost_coefficient: int, iterations: int = 100,
+                    max_time: float = 1.0):
+    """
+    Compute a lower bound of the objective of the VRP/TSP solver, i.e. the total distance of the routes plus the
+    global span cost coefficient times the longest route distance. The total distance is bounded by the Held-Karp bound
+    for a single vehicle, and by the minimum spanning tree for several vehicles, whose routes all meet at the depot.
+    The longest route is at least the total distance divided by the number of vehicles, and at least the longest round
+    trip from the depot.
+    :param distance_matrix: The distance matrix. Asymmetric matrices are bounded by their smallest direction.
+    :param depot: The start and end location for the route.
+    :param num_vehicles: The number of vehicles in the fleet.
+    :param cost_coefficient: The global span cost coefficient of the distance dimension.
+    :param iterations: Maximum number of subgradient iterations of the Held-Karp bound
+    :param max_time: Maximum computation time of the Held-Karp bound (In seconds)
+    :return: Lower bound of the objective
+    """
+    distances = np.asarray(distance_matrix, dtype=float)
+    weights = np.minimum(distances, distances.T)
+
+    if num_vehicles == 1 and len(weights) >= 3:
+        total_distance = one_tree_bound(weights, depot, iterations, max_time)
+    else:
+        total_distance, _ = spanning_tree(weights)
+
+    # Distances are integers, the tolerance absorbs the rounding errors
+    total_distance = max(math.ceil(total_distance - 1e-6), 0)
+    longest_route = max(math.ceil(total_distance / max(num_vehicles, 1)),
+                        math.ceil(longest_round_trip(distances, depot) - 1e-6))
+
+    return total_distance + cost_coefficient * longest_route
+
+
+def relative_gap(objective, lower_bound):
+    """
+    Compute the relative gap between an objective and its lower bound
+    :param objective: Objective of a solution
+    :param lower_bound: Lower bound of the objective
+    :return: Gap relative to the objective
+    """
+    if objective <= 0:
+        return 0.0
+
+    return max(objective - lower_bound, 0) / objective
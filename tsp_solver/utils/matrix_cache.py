@@ -0,0 +1,232 @@
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+
+# Version of the persisted cache format
+cache_version = 3
+
+
+def empty_store():
+    """
+    Create the storage of the pairs of one matrix kind: the sorted pair keys, their values, and the last request that
+    used them
+    :return: Dict of the key, value and usage arrays
+    """
+    return {
+        'keys': np.zeros(0, dtype=np.int64),
+        'values': np.zeros(0, dtype=np.int64),
+        'used': np.zeros(0, dtype=np.int64)
+    }
+
+
+class MatrixCache:
+    """
+    Cross-request cache of location pair values (distances or times), keyed by quantised coordinate IDs.
+    The pairs are stored in sorted numpy arrays, so that the pairs of a request are looked up and inserted in a few
+    vectorized operations. The number of cached pairs is bounded, and the least recently used pairs are evicted first,
+    together with the IDs of the locations no longer part of any pair.
+    """
+
+    def __init__(self, max_entries: int = 1000000, precision: int = 6, path: str = None, euclidean: bool = False):
+        """
+        :param max_entries: Maximum number of cached pairs per matrix kind
+        :param precision: Number of decimals kept when quantising coordinates
+        :param path: Optional file used to persist the cache on disk
+        :param euclidean: Whether the Euclidean matrices are cached too. They are computed faster than they are looked up.
+        """
+        self.max_entries = max_entries
+        self.precision = precision
+        self.path = path
+        self.euclidean = euclidean
+        self.location_ids = {}
+        self.next_id = 0
+        self.entries = {}
+        self.sources = {}
+        self.requests = 0
+        self.cell_time = 0.0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def bind(self, kind, source):
+        """
+        Declare the source of the values of a matrix kind, e.g. the identity of the road graph. The pairs cached from
+        another source, e.g. loaded from the disk after the road graph changed, are discarded.
+        :param kind: Name of the matrix kind
+        :param source: Identity of the source
+        """
+        with self.lock:
+            if self.sources.get(kind) == source:
+                return
+
+            if kind in self.entries:
+                logging.warning("Discarding the cached {} pairs computed from another source".format(kind))
+                del self.entries[kind]
+                self.evict_locations()
+                self.dirty = True
+            self.sources[kind] = source
+
+    def location_id(self, location):
+        """
+        Get the ID of a location, creating a new one for unseen coordinates
+        :param location: Location dict containing latitude and longitude
+        :return: Location ID
+        """
+        key = (round(location['latitude'], self.precision), round(location['longitude'], self.precision))
+        location_id = self.location_ids.get(key)
+        if location_id is None:
+            location_id = self.location_ids[key] = self.next_id
+            self.next_id += 1
+        return location_id
+
+    def matrix(self, kind, locations, compute):
+        """
+        Build the matrix of a list of locations, computing only the pairs missing from the cache
+        :param kind: Name of the matrix kind, e.g. euclidean_distance
+        :param locations: List of locations
+        :param compute: Function computing the matrix between a list of sources and a list of targets
+        :return: The matrix, and statistics containing the hits, the hit rate and the estimated time saved
+        """
+        size = len(locations)
+        result = np.zeros((size, size), dtype=np.int64)
+
+        with self.lock:
+            store = self.entries.setdefault(kind, empty_store())
+            ids = np.array([self.location_id(location) for location in locations], dtype=np.int64)
+            keys = (ids[:, None] << 32) | ids[None, :]
+
+            # Look up every pair at once, and mark the found pairs as used by this request
+            positions, found = self.find(store, keys)
+            self.requests += 1
+            store['used'][positions[found]] = self.requests
+            result[found] = store['values'][positions[found]]
+            hits = int(found.sum())
+
+        # Compute the rows having at least one missing pair in a single batch
+        missing_rows = np.flatnonzero(~found.all(axis=1))
+        compute_time = 0.0
+        if len(missing_rows):
+            started = time.perf_counter()
+            values = np.asarray(compute([locations[row] for row in missing_rows], locations), dtype=np.int64)
+            compute_time = time.perf_counter() - started
+            result[missing_rows] = values
+
+        with self.lock:
+            if len(missing_rows):
+                self.cell_time = compute_time / values.size
+                self.dirty = True
+                missing = ~found[missing_rows]
+                self.insert(kind, keys[missing_rows][missing], values[missing])
+
+            stats = {
+                'hits': hits,
+                'lookups': size * size,
+                'hit_rate': hits / (size * size) if size else 0.0,
+                'compute_time': compute_time,
+                'time_saved': hits * self.cell_time
+            }
+
+        return result.tolist(), stats
+
+    @staticmethod
+    def find(store, keys):
+        """
+        Find pair keys in the sorted keys of a matrix kind
+        :param store: The storage of the matrix kind
+        :param keys: Array of pair keys
+        :return: The positions of the keys in the storage, and whether they were found
+        """
+        positions = np.searchsorted(store['keys'], keys)
+        if not len(store['keys']):
+            return positions, np.zeros(keys.shape, dtype=bool)
+
+        positions = np.minimum(positions, len(store['keys']) - 1)
+        return positions, store['keys'][positions] == keys
+
+    def insert(self, kind, keys, values):
+        """
+        Insert pairs into the cache, then evict the least recently used pairs once the cache is full
+        :param kind: Name of the matrix kind
+        :param keys: Array of pair keys
+        :param values: Array of pair values
+        """
+        # Duplicate locations give duplicate keys, and other requests may have inserted the same pairs meanwhile
+        keys, unique = np.unique(keys, return_index=True)
+        values = values[unique]
+        store = self.entries[kind]
+        _, found = self.find(store, keys)
+        keys, values = keys[~found], values[~found]
+
+        positions = np.searchsorted(store['keys'], keys)
+        store['keys'] = np.insert(store['keys'], positions, keys)
+        store['values'] = np.insert(store['values'], positions, values)
+        store['used'] = np.insert(store['used'], positions, self.requests)
+
+        if len(store['keys']) > self.max_entries:
+            # Keep the most recently used pairs, in key order
+            kept = np.sort(np.argpartition(-store['used'], self.max_entries - 1)[:self.max_entries])
+            for name in store:
+                store[name] = store[name][kept]
+            self.evict_locations()
+
+    def evict_locations(self):
+        """
+        Forget the IDs of the locations which are no longer part of any cached pair.
+        """
+        referenced = [np.unique(np.concatenate([store['keys'] >> 32, store['keys'] & 0xFFFFFFFF]))
+                      for store in self.entries.values()]
+        referenced = np.unique(np.concatenate(referenced)) if referenced else np.zeros(0, dtype=np.int64)
+        if len(referenced) == len(self.location_ids):
+            return
+
+        ids = np.fromiter(self.location_ids.values(), dtype=np.int64, count=len(self.location_ids))
+        kept = np.isin(ids, referenced)
+        self.location_ids = {key: location_id for (key, location_id), keep in zip(self.location_ids.items(), kept)
+                             if keep}
+
+    def load(self):
+        """
+        Load the cache from the disk.
+        """
+        with open(self.path, 'rb') as file:
+            data = pickle.load(file)
+
+        if data.get('version') == cache_version and data['precision'] == self.precision:
+            self.location_ids = data['location_ids']
+            self.next_id = data['next_id']
+            self.entries = data['entries']
+            self.sources = data['sources']
+            self.requests = data['requests']
+            self.cell_time = data['cell_time']
+
+    def save(self):
+        """
+        Persist the cache on the disk, if a path is configured and the cache changed since the last save.
+        """
+        if self.path is None or not self.dirty:
+            return
+
+        with self.lock:
+            self.dirty = False
+            data = pickle.dumps({
+                'version': cache_version,
+                'precision': self.precision,
+                'location_ids': self.location_ids,
+                'next_id': self.next_id,
+                'entries': self.entries,
+                'sources': self.sources,
+                'requests': self.requests,
+                'cell_time': self.cell_time
+            })
+
+        # Write to a temporary file first to not corrupt the cache if the service is interrupted
+        with open(self.path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(self.path + '.tmp', self.path)
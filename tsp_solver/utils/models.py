@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
 
 class VrpRequest(BaseModel):
@@ -13,6 +13,12 @@ class VrpRequest(BaseModel):
     message_type: str
     max_distance: int
     cost_coefficient: int
+    collapse_duplicates: bool = True
+    duplicate_tolerance: float = 0.0
+    time_limit: Optional[float] = Field(None, gt=0)
+    profile: bool = False
+    include_empty_routes: bool = True
+    optimality_gap: Optional[float] = None
 
 
 class VrptwRequest(BaseModel):
@@ -27,6 +33,33 @@ class VrptwRequest(BaseModel):
     time_windows: List
     wait_time: int
     max_time_vehicle: int
+    collapse_duplicates: bool = True
+    duplicate_tolerance: float = 0.0
+    time_limit: Optional[float] = Field(None, gt=0)
+    profile: bool = False
+    include_slacks: bool = True
+    include_empty_routes: bool = True
+    horizon_length: Optional[int] = None
+    horizon_overlap: int = 0
+
+
+class CancelRequest(BaseModel):
+    """
+    The request cancellation message format
+    """
+    id: Optional[str]
+    message_type: str
+    request_id: str
+
+
+class ProfileRequest(BaseModel):
+    """
+    The profiling message format. The count applies to each worker process.
+    """
+    id: Optional[str]
+    message_type: str
+    count: int = 1
+    match: Dict = {}
 
 
 class VrpResponse:
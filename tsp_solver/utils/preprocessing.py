@@ -0,0 +1,112 @@
+def location_key(location, tolerance):
+    """
+    Compute the grouping key of a location. Locations sharing a key are considered coincident.
+    :param location: Location dict containing latitude and longitude
+    :param tolerance: Grid cell size (in degrees) used for grouping near-identical locations. Zero means exact match.
+    :return: Hashable key of the location
+    """
+    if tolerance > 0:
+        return round(location['latitude'] / tolerance), round(location['longitude'] / tolerance)
+
+    return location['latitude'], location['longitude']
+
+
+def intersect_time_windows(p, q):
+    """
+    Compute the intersection of two time windows
+    :param p: Time window 1
+    :param q: Time window 2
+    :return: The intersected time window, or None if the windows are not compatible
+    """
+    start, end = max(p[0], q[0]), min(p[1], q[1])
+    if start > end:
+        return None
+
+    return [start, end]
+
+
+def collapse_locations(locations, depot, time_windows=None, tolerance=0.0):
+    """
+    Group coincident locations into a single solver node. The depot is never merged with other stops. In case of
+    time windows, stops are merged only if their windows overlap, and the group gets the intersection of the windows.
+    :param locations: List of locations
+    :param depot: The index of the depot
+    :param time_windows: Optional list of time windows for the locations
+    :param tolerance: Grid cell size (in degrees) used for grouping near-identical locations. Zero means exact match.
+    :return: Json object containing reduced locations, depot, time windows, and the original indices of every group
+    """
+    if not 0 <= depot < len(locations):
+        raise ValueError("depot should be a valid location index.")
+
+    if time_windows is not None and len(time_windows) != len(locations):
+        raise ValueError("Time windows should be provided for every location.")
+
+    groups = []
+    group_windows = []
+    candidates = {}
+
+    for location_idx, location in enumerate(locations):
+        window = time_windows[location_idx] if time_windows is not None else None
+
+        if location_idx != depot:
+            key = location_key(location, tolerance)
+            merged = False
+
+            # Try to merge into one of the existing groups sharing the same key
+            for group_idx in candidates.setdefault(key, []):
+                if window is None:
+                    groups[group_idx].append(location_idx)
+                    merged = True
+                    break
+
+                intersection = intersect_time_windows(group_windows[group_idx], window)
+                if intersection is not None:
+                    groups[group_idx].append(location_idx)
+                    group_windows[group_idx] = intersection
+                    merged = True
+                    break
+
+            if merged:
+                continue
+
+            candidates[key].append(len(groups))
+
+        groups.append([location_idx])
+        group_windows.append(list(window) if window is not None else None)
+
+    reduced_depot = next(group_idx for group_idx, group in enumerate(groups) if group[0] == depot)
+
+    return {
+        'locations': [locations[group[0]] for group in groups],
+        'depot': reduced_depot,
+        'time_windows': group_windows if time_windows is not None else None,
+        'groups': groups
+    }
+
+
+def expand_routes(solution, groups):
+    """
+    Expand the routes of a reduced instance back into consecutive visits of the original locations
+    :param solution: Json object created by get_routes of the VRP or VRPTW solver
+    :param groups: Original location indices of every reduced node, as created by collapse_locations
+    :return: The solution containing original location indices
+    """
+    for route in solution['routes']:
+        nodes = route['route']
+        expanded = []
+        # Per-stop times, either [earliest, latest] pairs or earliest arrival times
+        time_keys = [key for key in ('time_windows', 'arrival_times') if key in route]
+        expanded_times = {key: [] for key in time_keys}
+
+        for position, node in enumerate(nodes):
+            # The depot appears at both ends of a route, so it is expanded only once there
+            members = groups[node] if 0 < position < len(nodes) - 1 else groups[node][:1]
+            expanded.extend(members)
+
+            for key in time_keys:
+                expanded_times[key].extend([route[key][position]] * len(members))
+
+        route['route'] = expanded
+        route.update(expanded_times)
+
+    return solution
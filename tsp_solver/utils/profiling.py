@@ -0,0 +1,151 @@
+import contextlib
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# The standard error is redirected by one profiled solve at a time
+stderr_lock = threading.Lock()
+
+
+class RequestProfiler:
+    """
+    Deterministic profiler of a single request. It may be enabled successively from different threads, e.g. for the
+    parsing in the event loop and for the solving in a worker thread. The profile is written in the pstats format,
+    together with the objective log and the ortools search log of the solver.
+    """
+
+    def __init__(self, directory: str, request_id):
+        """
+        :param directory: Directory where the profiles are written
+        :param request_id: Id of the profiled request
+        """
+        self.directory = directory
+        self.request_id = request_id
+        # The request id comes from the client, it must not lead outside the directory
+        file_id = re.sub(r'[^\w.-]', '_', str(request_id))
+        self.prefix = os.path.join(directory, '{}-{}'.format(file_id, int(time.time() * 1000)))
+        self.profile = cProfile.Profile()
+        self.search_log = []
+
+        # Whether the ortools search log is being captured, and should then be enabled
+        self.log_search = False
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.disable()
+
+    def runcall(self, func, *args, **kwargs):
+        """
+        Run a function under the profiler, capturing the ortools search log
+        """
+        with self.capture_search_log():
+            return self.profile.runcall(func, *args, **kwargs)
+
+    @contextlib.contextmanager
+    def capture_search_log(self):
+        """
+        Redirect the standard error, where ortools writes its search log, to the search log file of the request. The
+        redirection applies to the whole process: the standard error of the other threads is captured meanwhile, and
+        the search log is only captured by one profiled solve at a time.
+        """
+        if not stderr_lock.acquire(blocking=False):
+            yield
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            sys.stderr.flush()
+            stderr = os.dup(2)
+            with open(self.prefix + '.search.log', 'ab') as file:
+                os.dup2(file.fileno(), 2)
+
+            self.log_search = True
+            try:
+                yield
+            finally:
+                self.log_search = False
+                sys.stderr.flush()
+                os.dup2(stderr, 2)
+                os.close(stderr)
+        finally:
+            stderr_lock.release()
+
+    def save(self):
+        """
+        Write the profile and the objective log of the request, next to its search log
+        :return: Path of the profile file
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.profile.dump_stats(self.prefix + '.prof')
+        with open(self.prefix + '.search.json', 'w') as file:
+            json.dump([{'elapsed': elapsed, 'objective': objective} for elapsed, objective in self.search_log], file)
+
+        return self.prefix + '.prof'
+
+
+class ProfileCaptures:
+    """
+    Pending profiling captures of a process. Every consumer of the process receives the PROFILE messages through the
+    control exchange, the captures are then shared by the consumers, so that the next matching requests of the process
+    are profiled, whichever consumer receives them. It is only used from the event loop.
+    """
+
+    def __init__(self, max_received: int = 1000):
+        """
+        :param max_received: Maximum number of remembered PROFILE messages, received once by every consumer
+        """
+        self.captures = []
+        self.received = OrderedDict()
+        self.max_received = max_received
+
+    def add(self, key, count: int, match: dict) -> bool:
+        """
+        Add the capture of a PROFILE message, unless another consumer of the process already added it
+        :param key: Key of the PROFILE message
+        :param count: Number of requests to profile
+        :param match: Dict of the field values of the requests to profile
+        :return: Whether the capture was added
+        """
+        if key in self.received:
+            return False
+
+        self.received[key] = True
+        while len(self.received) > self.max_received:
+            self.received.popitem(last=False)
+
+        self.captures.append({'remaining': count, 'match': match})
+        return True
+
+    def take(self, json_data) -> bool:
+        """
+        Count a request against the first capture it matches
+        :param json_data: Request data
+        :return: Whether the request is to be profiled
+        """
+        capture = next((capture for capture in self.captures if matches(json_data, capture['match'])), None)
+        if capture is None:
+            return False
+
+        capture['remaining'] -= 1
+        if capture['remaining'] <= 0:
+            self.captures.remove(capture)
+        return True
+
+
+def matches(json_data, match):
+    """
+    Check whether a request matches all fields of a filter
+    :param json_data: Request data
+    :param match: Dict of field values
+    :return: True if all fields are equal
+    """
+    return all(json_data.get(key) == value for key, value in match.items())
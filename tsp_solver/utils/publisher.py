@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+import aio_pika
+from pamqp.commands import Basic
+from aio_pika.message import IncomingMessage
+from aio_pika.exchange import Exchange
+
+
+class OutboundPublisher:
+    """
+    Publishes the responses in the background through a bounded buffer. The responses are published in batches, and
+    their publisher confirms are awaited together. The incoming message of a response is acked only once the broker
+    confirmed the response, and requeued otherwise.
+    """
+
+    def __init__(self, exchange: Exchange, routing_key: str, buffer_size: int = 100, batch_size: int = 20):
+        """
+        :param exchange: aio_pika exchange used to publish the responses
+        :param routing_key: Routing key of the responses
+        :param buffer_size: Maximum number of responses waiting to be published
+        :param batch_size: Maximum number of responses published at once
+        """
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.batch_size = batch_size
+        self.buffer = asyncio.Queue(maxsize=buffer_size)
+        self.publishing_task = None
+
+    async def publish(self, message: aio_pika.Message, incoming_message: IncomingMessage):
+        """
+        Add a response to the buffer, waiting for free space if the buffer is full
+        :param message: Response message
+        :param incoming_message: The incoming message to be acked once the response is confirmed
+        """
+        if self.publishing_task is None:
+            self.publishing_task = asyncio.create_task(self.run())
+
+        await self.buffer.put((message, incoming_message))
+
+    async def run(self):
+        """
+        Publish the buffered responses forever.
+        """
+        while True:
+            batch = [await self.buffer.get()]
+            while len(batch) < self.batch_size and not self.buffer.empty():
+                batch.append(self.buffer.get_nowait())
+
+            try:
+                await self.publish_batch(batch)
+            finally:
+                for _ in batch:
+                    self.buffer.task_done()
+
+    async def publish_batch(self, batch):
+        """
+        Publish a batch of responses and settle their incoming messages
+        :param batch: List of (response message, incoming message) pairs
+        """
+        confirmations = await asyncio.gather(
+            *[self.exchange.publish(message, routing_key=self.routing_key) for message, _ in batch],
+            return_exceptions=True)
+
+        for (message, incoming_message), confirmation in zip(batch, confirmations):
+            try:
+                # Without publisher confirms on the channel, the broker does not send any confirmation
+                if confirmation is None or isinstance(confirmation, Basic.Ack):
+                    await incoming_message.ack()
+                else:
+                    logging.warning("Response {} was not confirmed by the broker: {!r}".format(
+                        message.correlation_id, confirmation))
+                    await incoming_message.nack(requeue=True)
+            except Exception:
+                logging.exception("Could not settle the incoming message of response {}".format(
+                    message.correlation_id))
+
+    async def flush(self):
+        """
+        Wait until all buffered responses are published and confirmed.
+        """
+        await self.buffer.join()
+
+    async def close(self, timeout: float):
+        """
+        Flush the buffered responses within a timeout, then stop publishing in the background. The responses left in
+        the buffer are dropped, their incoming messages being requeued by the broker once the channel is closed.
+        :param timeout: Time to wait for the buffered responses to be confirmed (In seconds)
+        """
+        if self.publishing_task is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("{} responses were not published within {}s".format(self.buffer.qsize(), timeout))
+
+        self.publishing_task.cancel()
+        await asyncio.gather(self.publishing_task, return_exceptions=True)
+        self.publishing_task = None
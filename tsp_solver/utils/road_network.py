@@ -0,0 +1,140 @@
+import hashlib
+import multiprocessing
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+# Number of source nodes solved in a single batched shortest path call (bounds the memory of a batch)
+source_chunk_size = 16
+
+# Road network loaded by every worker process of the pool
+_worker_network = None
+
+
+class RoadNetwork:
+    """
+    Road graph stored as a compact CSR adjacency array, used to compute travel distance and time matrices between
+    locations based on shortest paths instead of straight lines.
+
+    The graph file is a numpy .npz archive containing the following arrays:
+        - indptr, indices: CSR adjacency of the directed road graph
+        - distance, duration: Edge weights aligned with indices, in the units used by the solver
+        - latitude, longitude: Coordinates of the graph nodes
+    """
+
+    def __init__(self, path: str, workers: int = 1):
+        """
+        :param path: Path of the graph file
+        :param workers: Number of processes used to compute shortest paths. If set 1, paths are computed in-process.
+        """
+        with np.load(path) as data:
+            shape = (len(data['latitude']), len(data['latitude']))
+            self.graphs = {
+                'distance': csr_matrix((data['distance'], data['indices'], data['indptr']), shape=shape),
+                'duration': csr_matrix((data['duration'], data['indices'], data['indptr']), shape=shape)
+            }
+            self.tree = cKDTree(np.column_stack((data['latitude'], data['longitude'])))
+
+            # Identity of the graph content, e.g. to discard the matrices cached from another graph
+            digest = hashlib.md5()
+            for name in ('indptr', 'indices', 'distance', 'duration', 'latitude', 'longitude'):
+                digest.update(np.ascontiguousarray(data[name]).tobytes())
+            self.identity = digest.hexdigest()
+
+        self.path = path
+        self.workers = workers
+
+        # The worker processes are started by a fork server rather than forked from the service process, which runs
+        # the event loop and the solver threads. They are only started once shortest paths are computed.
+        self.pool = None
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('forkserver'),
+                                            initializer=_init_worker,
+                                            initargs=(path,))
+
+    def snap(self, locations):
+        """
+        Snap locations to their nearest graph nodes
+        :param locations: List of locations
+        :return: Array of graph node indices
+        """
+        points = np.array([[location['latitude'], location['longitude']] for location in locations])
+        _, nodes = self.tree.query(points)
+        return nodes
+
+    def shortest_paths(self, weight, sources, targets):
+        """
+        Compute the many-to-many shortest path costs between graph nodes
+        :param weight: Edge weight to be used, either distance or duration
+        :param sources: Array of source graph nodes
+        :param targets: Array of target graph nodes
+        :return: Matrix whose i, j entry is the cost from sources[i] to targets[j]
+        """
+        # Every distinct source node is solved once, in batches
+        unique_sources, inverse = np.unique(sources, return_inverse=True)
+        chunks = [unique_sources[i:i + source_chunk_size] for i in range(0, len(unique_sources), source_chunk_size)]
+
+        pool = self.pool
+        if pool is not None and len(chunks) > 1:
+            results = pool.map(_worker_shortest_paths, [weight] * len(chunks), chunks, [targets] * len(chunks))
+        else:
+            results = (_shortest_paths(self.graphs[weight], chunk, targets) for chunk in chunks)
+
+        costs = np.vstack(list(results))[inverse]
+
+        if not np.isfinite(costs).all():
+            raise ValueError("Some locations are not reachable in the road network.")
+
+        return np.rint(costs).astype(np.int64)
+
+    def distance_matrix(self, sources, targets):
+        """
+        Compute the road distances between two lists of locations
+        :param sources: List of origin locations
+        :param targets: List of destination locations
+        :return: Matrix whose i, j entry is the distance from sources[i] to targets[j]
+        """
+        return self.shortest_paths('distance', self.snap(sources), self.snap(targets))
+
+    def time_matrix(self, sources, targets):
+        """
+        Compute the road travel times between two lists of locations
+        :param sources: List of origin locations
+        :param targets: List of destination locations
+        :return: Matrix whose i, j entry is the travel time from sources[i] to targets[j]
+        """
+        return self.shortest_paths('duration', self.snap(sources), self.snap(targets))
+
+    def close(self):
+        """
+        Shutdown the worker processes.
+        """
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+def _shortest_paths(graph, sources, targets):
+    """
+    Run a batched single-source shortest path search from every source, and keep the target columns only.
+    """
+    return dijkstra(graph, directed=True, indices=sources)[:, targets]
+
+
+def _init_worker(path):
+    """
+    Load the road network once per worker process.
+    """
+    global _worker_network
+    _worker_network = RoadNetwork(path)
+
+
+def _worker_shortest_paths(weight, sources, targets):
+    """
+    Compute shortest paths inside a worker process.
+    """
+    return _shortest_paths(_worker_network.graphs[weight], sources, targets)
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+
+def problem_bucket(message_type, num_nodes, num_vehicles, time_windows=None):
+    """
+    Compute the bucket of a problem, used to group similar problems
+    :param message_type: The message type, i.e. TSP, VRP, or VRPTW
+    :param num_nodes: Number of locations
+    :param num_vehicles: Number of vehicles
+    :param time_windows: Optional list of time windows for the locations
+    :return: Bucket name
+    """
+    tightness = 0.0
+    if time_windows:
+        windows = np.array(time_windows, dtype=float)
+        horizon = windows[:, 1].max() - windows[:, 0].min()
+        if horizon > 0:
+            tightness = 1 - (windows[:, 1] - windows[:, 0]).mean() / horizon
+
+    # Node and vehicle counts are bucketed by powers of two, and the time window tightness by quarters
+    return '{}:{}:{}:{}'.format(message_type, int(num_nodes).bit_length(), int(num_vehicles).bit_length(),
+                                round(tightness * 4) / 4)
+
+
+def time_to_improvement(search_log, time_limit, improvement_ratio):
+    """
+    Compute the time needed by a search to reach a ratio of its total improvement
+    :param search_log: List of (elapsed time, objective) pairs of the solutions found
+    :param time_limit: Time limit of the search
+    :param improvement_ratio: Ratio of the total improvement
+    :return: The time needed, doubled if the search was still improving close to its time limit
+    """
+    first_objective, final_objective = search_log[0][1], search_log[-1][1]
+    target = final_objective + (first_objective - final_objective) * (1 - improvement_ratio)
+    elapsed = next(elapsed for elapsed, objective in search_log if objective <= target)
+
+    if elapsed >= 0.9 * time_limit:
+        return 2 * time_limit
+
+    return elapsed
+
+
+class SearchBudgetTuner:
+    """
+    Choose the search time limit of a problem based on the objective versus time curves of the past solves of similar
+    problems, at the point of diminishing returns.
+    """
+
+    def __init__(self, min_time: float = 1.0, max_time: float = 30.0, improvement_ratio: float = 0.99,
+                 quantile: float = 0.9, min_samples: int = 5, history_size: int = 50, path: str = None):
+        """
+        :param min_time: Lower bound of the chosen time limits (In seconds)
+        :param max_time: Upper bound of the chosen time limits (In seconds)
+        :param improvement_ratio: Ratio of the total improvement considered as the point of diminishing returns
+        :param quantile: Quantile of the past solves which should reach the point of diminishing returns
+        :param min_samples: Number of past solves needed before learning a bucket. Until then, max_time is used.
+        :param history_size: Number of past solves kept per bucket
+        :param path: Optional file used to persist the tuner state
+        """
+        self.min_time = min_time
+        self.max_time = max_time
+        self.improvement_ratio = improvement_ratio
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.history_size = history_size
+        self.path = path
+        self.history = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self.history = json.load(file)
+
+    def choose(self, bucket):
+        """
+        Choose the time limit of a problem
+        :param bucket: Bucket of the problem
+        :return: Json object containing the time limit and the reason of the choice
+        """
+        with self.lock:
+            samples = list(self.history.get(bucket, []))
+
+        if len(samples) < self.min_samples:
+            return {
+                'time_limit': self.max_time,
+                'reason': "Exploring bucket {} with {} past solves.".format(bucket, len(samples))
+            }
+
+        time_limit = min(max(float(np.quantile(samples, self.quantile)), self.min_time), self.max_time)
+
+        return {
+            'time_limit': time_limit,
+            'reason': "{:.0%} of the {} past solves in bucket {} reached {:.0%} of their improvement within {:.2f}s."
+            .format(self.quantile, len(samples), bucket, self.improvement_ratio, time_limit)
+        }
+
+    def record(self, bucket, search_log, time_limit):
+        """
+        Record the objective versus time curve of a solve
+        :param bucket: Bucket of the problem
+        :param search_log: List of (elapsed time, objective) pairs of the solutions found
+        :param time_limit: Time limit of the search
+        """
+        if not search_log:
+            return
+
+        elapsed = time_to_improvement(search_log, time_limit, self.improvement_ratio)
+
+        with self.lock:
+            samples = self.history.setdefault(bucket, [])
+            samples.append(elapsed)
+            del samples[:-self.history_size]
+            self.dirty = True
+
+    def save(self):
+        """
+        Persist the tuner state on the disk, if a path is configured and the state changed since the last save.
+        """
+        if self.path is None or not self.dirty:
+            return
+
+        with self.lock:
+            self.dirty = False
+            data = json.dumps(self.history)
+
+        with open(self.path + '.tmp', 'w') as file:
+            file.write(data)
+        os.replace(self.path + '.tmp', self.path)
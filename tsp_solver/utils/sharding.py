@@ -0,0 +1,104 @@
+import hashlib
+
+# Alphabet of the base 32 geohash encoding
+geohash_alphabet = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(latitude: float, longitude: float, precision: int = 4) -> str:
+    """
+    Encode coordinates as a geohash, whose prefixes identify nested rectangular regions
+    :param latitude: Latitude in degrees
+    :param longitude: Longitude in degrees
+    :param precision: Number of characters of the geohash, e.g. 4 for cells of about 39km x 20km
+    :return: The geohash
+    """
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    characters = []
+    bits, value, even = 0, 0, True
+
+    while len(characters) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        coordinate, interval = (longitude, longitude_range) if even else (latitude, latitude_range)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = (value << 1) | 1
+            interval[0] = middle
+        else:
+            value <<= 1
+            interval[1] = middle
+
+        even = not even
+        bits += 1
+        if bits == 5:
+            characters.append(geohash_alphabet[value])
+            bits, value = 0, 0
+
+    return ''.join(characters)
+
+
+def region_key(json_data, precision: int = 4) -> str:
+    """
+    Compute the region of a request, i.e. the geohash of its depot
+    :param json_data: Request data
+    :param precision: Number of characters of the geohash
+    :return: The region, or an empty string if the request has no valid depot location
+    """
+    try:
+        depot = json_data['locations'][json_data.get('depot', 0)]
+        return geohash(float(depot['latitude']), float(depot['longitude']), precision)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return ''
+
+
+def stable_hash(key: str) -> int:
+    """
+    Hash a string into 64 bits, identically across processes and hosts
+    :param key: The string
+    :return: The hash
+    """
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def shard_of(region: str, num_shards: int) -> int:
+    """
+    Map a region to a shard with the jump consistent hash, so that only 1/n of the regions move when the number of
+    shards grows to n
+    :param region: The region
+    :param num_shards: Number of shards
+    :return: Shard number
+    """
+    key = stable_hash(region)
+    bucket, candidate = -1, 0
+    while candidate < num_shards:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+
+    return bucket
+
+
+def assign_shards(num_shards: int, members) -> dict:
+    """
+    Assign every shard to one member with rendezvous hashing, so that only the shards of a leaving member, or the
+    shards taken by a joining member, move when the members change
+    :param num_shards: Number of shards
+    :param members: Ids of the members
+    :return: Dict of the shard numbers assigned to every member
+    """
+    assignment = {member: [] for member in members}
+    for shard in range(num_shards):
+        owner = max(members, key=lambda member: stable_hash('{}:{}'.format(member, shard)), default=None)
+        if owner is not None:
+            assignment[owner].append(shard)
+
+    return assignment
+
+
+def shard_queue_name(queue_name: str, shard: int) -> str:
+    """
+    Name of the queue of a shard
+    :param queue_name: Name of the input queue
+    :param shard: Shard number
+    :return: Queue name
+    """
+    return '{}.{}'.format(queue_name, shard)
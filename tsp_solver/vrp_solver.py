@@ -1,7 +1,13 @@
+import threading
+import time
+
 import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
+from tsp_solver.utils.extraction import read_routes, is_empty_route
+from tsp_solver.utils.lower_bound import relative_gap
+
 
 def create_data_model(distance_matrix, depot, num_vehicles):
     """
@@ -47,35 +53,32 @@ def print_solution(data, manager, routing, solution):
     print('Maximum of the route distances: {}m'.format(max_route_distance))
 
 
-def get_routes(solution, routing, manager):
+def get_routes(solution, routing, manager, distance_matrix, include_empty_routes: bool = True):
     """
     Get vehicle routes from a solution and store them in an array. i,j entry is the jth location visited by vehicle i along its route.
     :param solution: The ortools routing solution object
     :param routing: The routing object
     :param manager: The manager object
+    :param distance_matrix: The distance matrix of the arc costs
+    :param include_empty_routes: Whether the routes of unused vehicles are included
     :return: List containing available routes
     """
 
     routes = []
     max_route_distance = 0
 
-    # Iterate over routes
-    for route_nbr in range(routing.vehicles()):
-        index = routing.Start(route_nbr)
-        route = [manager.IndexToNode(index)]
-        route_distance = 0
-
-        # Obtain route locations and distance
-        while not routing.IsEnd(index):
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route.append(manager.IndexToNode(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, route_nbr)
+    # Read all routes at once, the route distances being summed from the distance matrix rather than the arc costs
+    route_indices, nodes = read_routes(solution, routing, manager)
+    for route_nbr, indices in enumerate(route_indices):
+        route = nodes[indices].tolist()
+        route_distance = sum(distance_matrix[from_node][to_node] for from_node, to_node in zip(route, route[1:]))
 
         # Compute the max distance
         max_route_distance = max(route_distance, max_route_distance)
 
+        if not include_empty_routes and is_empty_route(route):
+            continue
+
         routes.append({
             "route": route,
             "vehicle": route_nbr,
@@ -92,7 +95,14 @@ def ortools_vrp_solver(distance_matrix: list[list[int]],
                        depot: int,
                        num_vehicles: int,
                        max_distance: int,
-                       cost_coefficient: int):
+                       cost_coefficient: int,
+                       cancel_event: threading.Event = None,
+                       time_limit: float = None,
+                       search_log: list = None,
+                       log_search: bool = False,
+                       include_empty_routes: bool = True,
+                       lower_bound: int = None,
+                       optimality_gap: float = None):
     """
     Entry point for finding the optimal path between points using the ortools library
     :param cost_coefficient: Difference between the largest value of route end cumul variables and the smallest value of route start cumul variables.
@@ -100,6 +110,13 @@ def ortools_vrp_solver(distance_matrix: list[list[int]],
     :param num_vehicles: The number of vehicles in the fleet. If set 1, it would be TSP.
     :param depot: The start and end location for the route.
     :param distance_matrix: The distance matrix is an array whose i, j entry is the distance from location i to location j.
+    :param cancel_event: Optional event aborting the search once set.
+    :param time_limit: Optional search time limit (In seconds). If set, the search continues with guided local search until the limit.
+    :param search_log: Optional list receiving the (elapsed time, objective) pair of every solution found.
+    :param log_search: Whether the ortools search log should be written to the standard error.
+    :param include_empty_routes: Whether the routes of unused vehicles are included in the result.
+    :param lower_bound: Optional lower bound of the objective. If set, the bound and the gap of the solution are reported.
+    :param optimality_gap: Optional relative gap to the lower bound at which the search stops.
     :return: Json object containing optimal routes
     """
 
@@ -149,16 +166,44 @@ def ortools_vrp_solver(distance_matrix: list[list[int]],
     search_parameters.first_solution_strategy = (routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
 
     # Set local search as optimizer (Link: https://developers.google.com/optimization/routing/routing_options#local_search_options)
-    # search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-    # search_parameters.time_limit.seconds = 30
-    # search_parameters.log_search = True
+    if time_limit is not None:
+        search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    search_parameters.log_search = log_search
+
+    # Record the objective of every solution found along the search
+    if search_log is not None:
+        started = time.monotonic()
+        routing.AddAtSolutionCallback(
+            lambda: search_log.append((time.monotonic() - started, routing.CostVar().Value())))
+
+    # Abort the search as soon as the request gets cancelled
+    if cancel_event is not None:
+        routing.AddSearchMonitor(routing.solver().CustomLimit(cancel_event.is_set))
+
+    # Stop the search as soon as a solution is proven close enough to the optimum
+    if lower_bound is not None and optimality_gap is not None:
+        gap_reached = threading.Event()
+
+        def check_gap():
+            if relative_gap(routing.CostVar().Value(), lower_bound) <= optimality_gap:
+                gap_reached.set()
+
+        routing.AddAtSolutionCallback(check_gap)
+        routing.AddSearchMonitor(routing.solver().CustomLimit(gap_reached.is_set))
 
     # Solve the problem.
     solution = routing.SolveWithParameters(search_parameters)
 
     if solution:
         # Get routes from the solution
-        routes = get_routes(solution, routing, manager)
+        routes = get_routes(solution, routing, manager, distance_matrix, include_empty_routes)
+
+        if lower_bound is not None:
+            routes['lower_bound'] = lower_bound
+            routes['gap'] = relative_gap(solution.ObjectiveValue(), lower_bound)
+
         return routes
 
     raise Exception("Could not find an optimal route.")
@@ -1,7 +1,12 @@
+import threading
+import time
+
 import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
+from tsp_solver.utils.extraction import read_routes, read_cumuls, is_empty_route
+
 
 def create_data_model(time_matrix, time_windows, depot, num_vehicles):
     """
@@ -54,46 +59,45 @@ def print_solution(data, manager, routing, solution):
     print('Total time of all routes: {}min'.format(total_time))
 
 
-def get_routes(solution, manager, routing, dimension):
+def get_routes(solution, manager, routing, dimension, include_slacks: bool = True, include_empty_routes: bool = True):
     """
     Get cumulative data from a dimension and store it in a json object.
     :param solution: The ortools routing solution instance
     :param manager: The manager instance
     :param routing: The routing instance
     :param dimension: The dimension
+    :param include_slacks: Whether the [earliest, latest] times of every stop are included. Otherwise, only the
+        earliest arrival times are.
+    :param include_empty_routes: Whether the routes of unused vehicles are included
     :return: List containing potential optimal routes
     """
 
     total_time = 0
     routes = []
 
-    # Iterate over routes
-    for route_nbr in range(routing.vehicles()):
-        index = routing.Start(route_nbr)
-        route = [manager.IndexToNode(index)]
-
-        time_var = dimension.CumulVar(index)
-        time_data = [[solution.Min(time_var), solution.Max(time_var)]]
-
-        # Iterate over route indices to provide locations where route have to pass
-        while not routing.IsEnd(index):
-            index = solution.Value(routing.NextVar(index))
-
-            route.append(manager.IndexToNode(index))
-
-            time_var = dimension.CumulVar(index)
-            time_data.append([solution.Min(time_var), solution.Max(time_var)])
+    # Read all routes and cumul values at once
+    route_indices, nodes = read_routes(solution, routing, manager)
+    earliest, latest = read_cumuls(solution, dimension, len(nodes), include_slacks)
 
+    for route_nbr, indices in enumerate(route_indices):
         # Get route time
-        route_time = solution.Min(time_var)
+        route_time = int(earliest[indices[-1]])
         total_time += route_time
 
-        routes.append({
-            "route": route,
-            "time_windows": time_data,
+        if not include_empty_routes and is_empty_route(indices):
+            continue
+
+        route = {
+            "route": nodes[indices].tolist(),
             "vehicle": route_nbr,
             "route_time": route_time
-        })
+        }
+        if include_slacks:
+            route["time_windows"] = np.stack([earliest[indices], latest[indices]], axis=1).tolist()
+        else:
+            route["arrival_times"] = earliest[indices].tolist()
+
+        routes.append(route)
 
     return {
         "routes": routes,
@@ -106,7 +110,16 @@ def ortools_vrptw_solver(time_matrix: list[list[int]],
                          depot: int,
                          num_vehicles: int,
                          wait_time: int,
-                         max_time_vehicle: int):
+                         max_time_vehicle: int,
+                         cancel_event: threading.Event = None,
+                         time_limit: float = None,
+                         search_log: list = None,
+                         log_search: bool = False,
+                         include_slacks: bool = True,
+                         include_empty_routes: bool = True,
+                         starts: list[int] = None,
+                         ends: list[int] = None,
+                         start_windows: list[list[int]] = None):
     """
     Solve the VRP with time windows.
     :param time_matrix: An array of travel times between locations.
@@ -115,6 +128,16 @@ def ortools_vrptw_solver(time_matrix: list[list[int]],
     :param num_vehicles: The number of vehicles in the fleet.
     :param wait_time: An upper bound for slack (the wait times at the locations).
     :param max_time_vehicle: An upper bound for the total time over each vehicle's route.
+    :param cancel_event: Optional event aborting the search once set.
+    :param time_limit: Optional search time limit (In seconds). If set, the search continues with guided local search until the limit.
+    :param search_log: Optional list receiving the (elapsed time, objective) pair of every solution found.
+    :param log_search: Whether the ortools search log should be written to the standard error.
+    :param include_slacks: Whether the [earliest, latest] times of every stop are included in the result, rather than
+        only the earliest arrival times.
+    :param include_empty_routes: Whether the routes of unused vehicles are included in the result.
+    :param starts: Optional start location of every vehicle. Defaults to the depot.
+    :param ends: Optional end location of every vehicle. Defaults to the depot.
+    :param start_windows: Optional time window of every vehicle start. Defaults to the time window of the start location.
     :return:
     """
 
@@ -125,8 +148,13 @@ def ortools_vrptw_solver(time_matrix: list[list[int]],
     assert wait_time >= 0, "Wait time should be greater than or equal to zero."
     assert max_time_vehicle >= 0, "Maximum time per vehicle should be greater than or equal to zero."
 
+    # Vehicles start and end at the depot, unless their own locations are given
+    starts = starts if starts is not None else [depot] * num_vehicles
+    ends = ends if ends is not None else [depot] * num_vehicles
+    start_windows = start_windows if start_windows is not None else [time_windows[start] for start in starts]
+
     # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(time_matrix), num_vehicles, depot)
+    manager = pywrapcp.RoutingIndexManager(len(time_matrix), num_vehicles, starts, ends)
 
     # Create Routing Model.
     routing = pywrapcp.RoutingModel(manager)
@@ -157,18 +185,18 @@ def ortools_vrptw_solver(time_matrix: list[list[int]],
         dimension_name)
     time_dimension = routing.GetDimensionOrDie(dimension_name)
 
-    # Add time window constraints for each location except depot.
+    # Add time window constraints for each location except the vehicle starts and ends.
+    terminals = set(starts) | set(ends)
     for location_idx, time_window in enumerate(time_windows):
-        if location_idx == depot:
+        if location_idx in terminals:
             continue
         index = manager.NodeToIndex(location_idx)
         time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
 
     # Add time window constraints for each vehicle start node.
-    depot_idx = depot
     for vehicle_id in range(num_vehicles):
         index = routing.Start(vehicle_id)
-        time_dimension.CumulVar(index).SetRange(time_windows[depot_idx][0], time_windows[depot_idx][1])
+        time_dimension.CumulVar(index).SetRange(start_windows[vehicle_id][0], start_windows[vehicle_id][1])
 
     # Instantiate route start and end times to produce feasible times.
     for i in range(num_vehicles):
@@ -179,12 +207,29 @@ def ortools_vrptw_solver(time_matrix: list[list[int]],
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
     search_parameters.first_solution_strategy = (routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
 
+    # Set local search as optimizer (Link: https://developers.google.com/optimization/routing/routing_options#local_search_options)
+    if time_limit is not None:
+        search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    search_parameters.log_search = log_search
+
+    # Record the objective of every solution found along the search
+    if search_log is not None:
+        started = time.monotonic()
+        routing.AddAtSolutionCallback(
+            lambda: search_log.append((time.monotonic() - started, routing.CostVar().Value())))
+
+    # Abort the search as soon as the request gets cancelled
+    if cancel_event is not None:
+        routing.AddSearchMonitor(routing.solver().CustomLimit(cancel_event.is_set))
+
     # Solve the problem.
     solution = routing.SolveWithParameters(search_parameters)
 
     if solution:
         # Get routes from the solution
-        routes = get_routes(solution, manager, routing, time_dimension)
+        routes = get_routes(solution, manager, routing, time_dimension, include_slacks, include_empty_routes)
         return routes
 
     raise Exception("Could not find an optimal route.")
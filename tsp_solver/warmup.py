@@ -0,0 +1,41 @@
+import logging
+import time
+
+
+def warm_up():
+    """
+    Import the solver modules, load the shared resources, and solve a small synthetic VRP and VRPTW, so that the
+    first real requests do not pay the one-time initialisation costs.
+    :return: The Dispatcher class
+    """
+    started = time.monotonic()
+
+    from tsp_solver.dispatcher import Dispatcher, load_road_network, load_matrix_cache, load_search_budget_tuner
+    from tsp_solver.utils.helpers import euclidean_distance_matrix, euclidean_time_matrix
+    from tsp_solver.utils.models import VrpRequest
+    from tsp_solver.vrp_solver import ortools_vrp_solver
+    from tsp_solver.vrptw_solver import ortools_vrptw_solver
+
+    imported = time.monotonic()
+
+    # Load the resources shared by the consumers
+    load_road_network()
+    load_matrix_cache()
+    load_search_budget_tuner()
+
+    # Solve synthetic problems, without going through the matrix cache and the search budget tuner
+    request = VrpRequest(id='warm-up', message_type='VRP', depot=0, num_vehicles=2, max_distance=100000,
+                         cost_coefficient=100,
+                         locations=[{'latitude': i * 0.37 % 1, 'longitude': i * 0.61 % 1} for i in range(10)])
+    distance_matrix = euclidean_distance_matrix(request.locations, request.locations).tolist()
+    time_matrix = euclidean_time_matrix(request.locations, request.locations).tolist()
+
+    ortools_vrp_solver(distance_matrix, request.depot, request.num_vehicles, request.max_distance,
+                       request.cost_coefficient)
+    ortools_vrptw_solver(time_matrix, [[0, 1000]] * len(time_matrix), request.depot, request.num_vehicles, 1000,
+                         1000)
+
+    logging.info("Warm-up finished in {:.3f}s (imports {:.3f}s)".format(time.monotonic() - started,
+                                                                        imported - started))
+
+    return Dispatcher